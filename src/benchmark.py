@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Scaling benchmark of the pipeline stages on synthetic pings.
+
+For every size a synthetic day is generated (synthetic_pings) together with
+towers and a zone grid, and run once through the stage chain to store each
+stage's input.  Every (stage, size) is then timed in a freshly forked
+process that only loads its input, so peak memory is that stage's alone:
+
+    sequential_deltas        raw pings, int device codes    (Sequential)
+    zheng_denoise            output of sequential_deltas    (Sequential)
+    sliding_window_denoise   output of zheng_denoise        (Sequential)
+    add_zone_id              output of sliding_window       (Binning_sequential)
+    dwell_transitions        binned day                     (TransitionMatrix, original)
+    dwell_transitions_vec    binned day                     (TransitionMatrix, vectorized)
+    process_file             binned day file                (binning_insights)
+
+Results go to ``<out>/<label>.json`` (label defaults to the git commit)
+with a log-log scaling plot next to it; --compare prints the time and
+memory ratios of two result files.
+
+Usage:
+    python benchmark.py --sizes 1e5 1e6 1e7
+    python benchmark.py --sizes 1e5 1e6 --stages zheng_denoise add_zone_id --repeat 3
+    python benchmark.py --compare bench_results/abc123.json bench_results/def456.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import synthetic_pings
+from run_metrics import reset_peak_rss, rss_mb
+
+SRC_DIR   = Path(__file__).resolve().parent
+WORK_DIR  = Path("bench_work")
+OUT_DIR   = Path("bench_results")
+SIZES     = (100_000, 1_000_000, 10_000_000)
+
+# stage → (notebook, code cells to exec, input stage)
+STAGES = {
+    "sequential_deltas":      ("Sequential.ipynb", (0,), "encoded"),
+    "zheng_denoise":          ("Sequential.ipynb", (0,), "sequential_deltas"),
+    "sliding_window_denoise": ("Sequential.ipynb", (0,), "zheng_denoise"),
+    "add_zone_id":            ("Binning_sequential.ipynb", (0,), "sliding_window_denoise"),
+    "dwell_transitions":      ("TransitionMatrix.ipynb", (0, 1, 2), "binned"),
+    "dwell_transitions_vec":  ("TransitionMatrix.ipynb", (0, 1, 2), "binned"),
+    "process_file":           (None, (), "binned"),
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s: %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+# ───────────── stage functions ─────────────
+
+def load_notebook(name: str, cells) -> dict:
+    """
+    Namespace of the given code cells; ``__name__`` is not "__main__", so
+    main() never runs.  TransitionMatrix's loop cell runs, but the work dir
+    has no data_binned/, so it finds nothing to do.
+    """
+    with open(SRC_DIR / name) as fh:
+        nb = json.load(fh)
+    ns = {"__name__": "benchmark_" + Path(name).stem}
+    for i in cells:
+        exec(compile("".join(nb["cells"][i]["source"]), f"{name}[{i}]", "exec"), ns)
+    return ns
+
+
+def stage_functions() -> dict:
+    """
+    stage → callable(input) → output frame, loaded from the notebooks with the
+    work dir as cwd (they resolve data/ and maps/ from it).  "add_time_bin"
+    is included for preparing the binned input.
+    """
+    ns = {}
+    for nb, cells in {(nb, cells) for nb, cells, _ in STAGES.values() if nb}:
+        ns[nb] = load_notebook(nb, cells)
+    seq, binning, trans = (ns["Sequential.ipynb"], ns["Binning_sequential.ipynb"],
+                           ns["TransitionMatrix.ipynb"])
+    import binning_insights
+
+    def process_file(fp: Path) -> pd.DataFrame:
+        binning_insights.process_file(fp)
+        return pd.read_parquet(binning_insights.features_path(fp))
+
+    return {
+        "sequential_deltas":      seq["sequential_deltas"],
+        "zheng_denoise":          seq["zheng_denoise"],
+        "sliding_window_denoise": seq["sliding_window_denoise"],
+        "add_zone_id":            binning["add_zone_id"],
+        "dwell_transitions":      trans["create_zone_transition_by_dwell_time"],
+        "dwell_transitions_vec":  trans["create_zone_transition_by_dwell_time_vectorized"],
+        "process_file":           process_file,
+        "add_time_bin":           binning["add_time_bin"],
+    }
+
+
+# ───────────── inputs (paths relative to the work dir) ─────────────
+
+def size_dir(rows: int) -> Path:
+    return Path(f"rows_{rows}")
+
+
+def input_path(rows: int, stage: str) -> Path:
+    return size_dir(rows) / "inputs" / f"{stage}.parquet"
+
+
+def prepare(fns: dict, rows: int, seed: int = 0) -> None:
+    """Generate the synthetic day for ``rows`` and store every stage's input."""
+    if input_path(rows, "binned").exists():
+        return
+    raw = input_path(rows, "raw")
+    synthetic_pings.write_day(raw, rows, seed, towers=pd.read_parquet(
+        Path("data") / "slovenia_towers.parquet"))
+    df = pd.read_parquet(raw)
+    df[["lat", "lon"]] = df[["lat", "lon"]].astype("float32")      # as denoise_day
+    # int32 device codes, as the device dictionary gives denoise_sharded
+    df["deviceid"] = pd.factorize(df["deviceid"], sort=True)[0].astype("int32")
+    df.to_parquet(input_path(rows, "encoded"), index=False)
+    for stage in ("sequential_deltas", "zheng_denoise", "sliding_window_denoise", "add_zone_id"):
+        df = fns[stage](df)
+        df.to_parquet(input_path(rows, stage), index=False)
+    # binned day, as Binning_sequential.bin_day writes it
+    df = fns["add_time_bin"](df[df["zone_id"] != -1].reset_index(drop=True))
+    df.to_parquet(input_path(rows, "binned"), index=False)
+    logger.info("Prepared inputs for %s rows", f"{rows:,}")
+
+
+# ───────────── measurement ─────────────
+
+def _measure(fns: dict, stage: str, rows: int, conn) -> None:
+    logging.getLogger().setLevel(logging.WARNING)               # stages log per step
+    fp = input_path(rows, STAGES[stage][2])
+    data = fp if stage == "process_file" else pd.read_parquet(fp)
+    input_rows = pq.ParquetFile(fp).metadata.num_rows
+    base = rss_mb("VmRSS")
+    reset_peak_rss()
+    t0 = time.perf_counter()
+    out = fns[stage](data)
+    seconds = time.perf_counter() - t0
+    peak = rss_mb("VmHWM")
+    conn.send({"seconds": seconds, "peak_rss_mb": peak, "delta_rss_mb": max(peak - base, 0.0),
+               "input_rows": input_rows, "output_rows": len(out)})
+    conn.close()
+
+
+def run_stage(fns: dict, stage: str, rows: int, timeout: float | None) -> dict:
+    """One measurement in a forked child; the stage functions are inherited, not pickled."""
+    ctx = mp.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_measure, args=(fns, stage, rows, send))
+    proc.start()
+    send.close()
+    try:
+        result = recv.recv() if recv.poll(timeout) else None
+    except EOFError:                                # the child died before sending
+        result = None
+    proc.join(5 if result is not None else 0)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+    if result is None:
+        return {"error": "timeout" if proc.exitcode in (None, -15) else f"exit {proc.exitcode}"}
+    return result
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def scaling_exponents(results: list[dict]) -> dict:
+    """Slope of log(seconds) over log(rows) per stage (1.0 = linear)."""
+    out = {}
+    for stage in dict.fromkeys(r["stage"] for r in results):
+        pts = [(r["rows"], r["seconds"]) for r in results
+               if r["stage"] == stage and r.get("seconds")]
+        if len(pts) >= 2:
+            x, y = np.log(np.array(pts, dtype=float)).T
+            out[stage] = float(np.polyfit(x, y, 1)[0])
+    return out
+
+
+def plot_scaling(report: dict, out_svg: Path) -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (ax_t, ax_m) = plt.subplots(1, 2, figsize=(12, 5))
+    for stage in dict.fromkeys(r["stage"] for r in report["results"]):
+        pts = sorted((r["rows"], r["seconds"], r["peak_rss_mb"]) for r in report["results"]
+                     if r["stage"] == stage and "seconds" in r)
+        if not pts:
+            continue
+        rows, secs, mem = zip(*pts)
+        ax_t.plot(rows, secs, marker="o", label=stage)
+        ax_m.plot(rows, mem, marker="o", label=stage)
+    for ax, ylabel in ((ax_t, "seconds"), (ax_m, "peak RSS (MB)")):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("input rows (synthetic pings)")
+        ax.set_ylabel(ylabel)
+        ax.grid(True, which="both", linestyle="--", alpha=0.4)
+    ax_t.legend(fontsize=8)
+    fig.suptitle(f"Stage scaling @ {report['commit']}")
+    fig.tight_layout()
+    fig.savefig(out_svg)
+    plt.close(fig)
+
+
+def run(sizes, stages, repeat: int = 1, timeout: float | None = None, seed: int = 0,
+        label: str | None = None) -> Path:
+    WORK_DIR.mkdir(parents=True, exist_ok=True)
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    commit = _commit()
+    out_dir = OUT_DIR.resolve()
+    os.chdir(WORK_DIR)                       # notebooks resolve data/ and maps/ from the cwd
+    if not Path("maps/minimalist_coning.geojson").exists():
+        Path("maps").mkdir(exist_ok=True)
+        synthetic_pings.synthetic_grid().to_file("maps/minimalist_coning.geojson", driver="GeoJSON")
+    if not Path("data/slovenia_towers.parquet").exists():
+        Path("data").mkdir(exist_ok=True)
+        synthetic_pings.synthetic_towers(seed=seed).to_parquet("data/slovenia_towers.parquet",
+                                                               index=False)
+
+    fns = stage_functions()
+    results = []
+    for rows in sizes:
+        prepare(fns, rows, seed)
+        for stage in stages:
+            runs = [run_stage(fns, stage, rows, timeout) for _ in range(repeat)]
+            ok = [r for r in runs if "error" not in r]
+            if ok:
+                best = min(ok, key=lambda r: r["seconds"])
+                best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in ok)
+            else:
+                best = runs[0]
+            results.append({"stage": stage, "rows": rows, **best})
+            logger.info("%-24s %12s rows  %s", stage, f"{rows:,}",
+                        f"{best['seconds']:8.2f}s  {best['peak_rss_mb']:8.0f} MB peak"
+                        if "seconds" in best else best["error"])
+
+    report = {
+        "label": label or commit,
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count()},
+        "seed": seed,
+        "repeat": repeat,
+        "results": results,
+        "scaling": scaling_exponents(results),
+    }
+    out_json = out_dir / f"{report['label']}.json"
+    with open(out_json, "w") as fh:
+        json.dump(report, fh, indent=2)
+    plot_scaling(report, out_json.with_name(f"{report['label']}_scaling.svg"))
+    logger.info("✔ Results in %s", out_json)
+    return out_json
+
+
+def compare(base_json: Path, new_json: Path) -> pd.DataFrame:
+    """Per (stage, rows): seconds and peak memory of both runs and new/base ratios."""
+    frames = []
+    for path in (base_json, new_json):
+        with open(path) as fh:
+            report = json.load(fh)
+        df = pd.DataFrame(report["results"]).set_index(["stage", "rows"])
+        frames.append(df[["seconds", "peak_rss_mb"]].add_suffix(f"@{report['label']}"))
+    df = frames[0].join(frames[1], how="outer")
+    df["time_ratio"] = df[frames[1].columns[0]] / df[frames[0].columns[0]]
+    df["mem_ratio"] = df[frames[1].columns[1]] / df[frames[0].columns[1]]
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline stage scaling benchmark")
+    parser.add_argument("--sizes", type=float, nargs="+", default=SIZES,
+                        help="input rows per run (10^5–10^8)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per point; fastest is kept")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="result name (default: git commit)")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("BASE", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with pd.option_context("display.width", 200, "display.max_rows", None):
+            print(compare(*args.compare).to_string(float_format=lambda v: f"{v:.3g}"))
+    else:
+        run([int(s) for s in args.sizes], args.stages, args.repeat, args.timeout, args.seed,
+            args.label)
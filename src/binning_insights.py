@@ -5,8 +5,22 @@ import pandas as pd
 import numpy as np
 import logging
 import io
+import argparse
+from functools import partial
 from pathlib import Path
 
+import pyarrow.parquet as pq
+
+from feature_state import ZoneHourState
+from parallel import N_WORKERS, map_parallel
+from pipeline_cache import StageCache
+from run_metrics import Lap, emit, write_prometheus
+from segments import (
+    factorize_keys, first_index, segment_entropy, segment_layout,
+    segment_extremes, segment_mean, segment_quantile, segment_sort,
+    segment_var,
+)
+
 # ───────────────────────── Config & Logging ─────────────────────────
 logging.basicConfig(
     level=logging.INFO,
@@ -18,26 +32,20 @@ logger = logging.getLogger(__name__)
 # Directories
 BINS_DIR  = Path("data_binned")
 FEATS_DIR = Path("data_bin_features")
+STATE_DIR = FEATS_DIR / "state"             # per-day mergeable states (--stream)
+ALL_DAYS_FILE = FEATS_DIR / "all_days_features.parquet"
 FEATS_DIR.mkdir(exist_ok=True, parents=True)
 
+COLUMNS = ["deviceid","datetime","lat","lon","zone_id","time_bin"]
+STREAM_BATCH_ROWS = 2_000_000               # rows per streamed record batch
+MEM_PER_DAY_GB    = 48                      # peak per worker, in-memory mode
+MEM_PER_DAY_GB_STREAM = 6                   # peak per worker, --stream
+
 # Constants
 R = 6_371_000.0  # Earth radius (m)
 
-def shannon_entropy(counts: np.ndarray) -> float:
-    p = counts / counts.sum()
-    return float(-(p * np.log2(p)).sum())
-
-def process_file(fp: Path):
-    stem = fp.stem
-    logger.info(f"▶ Processing {fp.name}")
-    df = pd.read_parquet(
-        fp,
-        columns=["deviceid","datetime","lat","lon","zone_id","time_bin"],
-    )
-    logger.info(f"   • Loaded {len(df):,} rows across "
-                f"{df['zone_id'].nunique():,} zones and {df['time_bin'].nunique():,} time bins")
-
-    # ───────────────────────── Compute Deltas ─────────────────────────
+def add_speeds(df: pd.DataFrame) -> pd.DataFrame:
+    """Sort by (deviceid, datetime) and add the per-ping speed_m_s column."""
     df = df.sort_values(["deviceid","datetime"]).reset_index(drop=True)
     dc = df["deviceid"] != df["deviceid"].shift(1)
 
@@ -62,122 +70,271 @@ def process_file(fp: Path):
     dt[dc]   = 0.0
 
     df["speed_m_s"] = dist / dt
-    logger.info("   • Computed per-ping speed_m_s")
-
-    # ───────────────────────── Feature Aggregation ─────────────────────────
-    grp = df.groupby(["zone_id","time_bin"], sort=False)
-
-    speed_stats = grp["speed_m_s"].agg(
-        speed_mean="mean",
-        speed_median="median",
-        speed_min="min",
-        speed_max="max",
-        speed_var="var",
-        speed_q25=lambda x: x.quantile(0.25),
-        speed_q75=lambda x: x.quantile(0.75),
-    ).reset_index()
+    return df
+
+
+def aggregate_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Segment-reduction engine for the zone×hour feature table.
+
+    Expects the output of `add_speeds` (sorted by deviceid, datetime).
+    (zone_id, time_bin, deviceid) are factorized once and every statistic is
+    a vectorized pass over contiguous segments, so the cost no longer grows
+    with a Python call per group. Rows come out in the same order and with the
+    same columns as the former chain of pandas groupbys.
+    """
+    zone  = df["zone_id"].to_numpy()
+    tbin  = df["time_bin"].to_numpy()
+    dev   = df["deviceid"].to_numpy()
+    speed = df["speed_m_s"].to_numpy(dtype="float64")
+    t_ns  = df["datetime"].to_numpy().astype("int64")
+    n     = len(df)
+
+    # ── (zone_id, time_bin) groups, in order of first appearance ──
+    g, ng = factorize_keys(zone, tbin)
+    first = first_index(g, ng)
+
+    # ── speed stats over non-null speeds (first ping of a device is NaN),
+    #    one lexsort gives min/max/median/quantiles ──
+    valid = ~np.isnan(speed)
+    gv, sv = g[valid], speed[valid]
+    order = segment_sort(gv, sv)
+    starts, counts = segment_layout(gv[order], ng)
+    spd_sorted = sv[order]
+    speed_mean = segment_mean(gv, sv, ng)
+    speed_min, speed_max = segment_extremes(spd_sorted, starts, counts)
+    ping_count = np.bincount(g, minlength=ng)
     logger.info("   • Speed stats computed")
 
-    density = grp["deviceid"].agg(
-        ping_count="size",
-        unique_devs=lambda x: x.nunique(),
-    ).reset_index()
-    density["pings_per_dev"] = density["ping_count"] / density["unique_devs"]
-
-    entropy = (
-        df.groupby(["zone_id","time_bin","deviceid"], sort=False).size()
-          .groupby(level=[0,1], sort=False)
-          .apply(lambda s: shannon_entropy(s.values))
-          .reset_index(name="dev_entropy")
-    )
+    # ── density & device entropy: one code per (group, device) pair ──
+    pair, npair = factorize_keys(g, dev)
+    pair_first = first_index(pair, npair)
+    pair_group = g[pair_first]
+    pair_count = np.bincount(pair, minlength=npair)
+    unique_devs = np.bincount(pair_group, minlength=ng)
     logger.info("   • Density & entropy computed")
 
-    dwell = (
-        df.groupby(["zone_id","time_bin","deviceid"], sort=False)["datetime"]
-          .agg(start="min", end="max")
-          .reset_index()
-    )
-    dwell["dwell_s"] = (dwell["end"] - dwell["start"]).dt.total_seconds()
-    dwell_stats = dwell.groupby(["zone_id","time_bin"], sort=False)["dwell_s"].agg(
-        dwell_mean="mean",
-        dwell_median="median",
-        dwell_min="min",
-        dwell_max="max",
-    ).reset_index()
+    # ── dwell: rows are time-ordered per device, so a stable sort by pair
+    #    puts each pair's first and last ping at the segment ends ──
+    p_order = segment_sort(pair)
+    p_starts, p_counts = segment_layout(pair[p_order], npair)
+    t_sorted = t_ns[p_order]
+    dwell_s = (t_sorted[p_starts + p_counts - 1] - t_sorted[p_starts]) / 1e9
+
+    d_order = segment_sort(pair_group, dwell_s)
+    d_starts, d_counts = segment_layout(pair_group[d_order], ng)
+    dwell_sorted = dwell_s[d_order]
+    dwell_min, dwell_max = segment_extremes(dwell_sorted, d_starts, d_counts)
     logger.info("   • Dwell time stats computed")
 
-    df["prev_zone"] = df.groupby("deviceid", sort=False)["zone_id"].shift(1)
-    df["next_zone"] = df.groupby("deviceid", sort=False)["zone_id"].shift(-1)
-
-    in_mask  = df["zone_id"] != df["prev_zone"]
-    out_mask = df["zone_id"] != df["next_zone"]
-    in_stats = df[in_mask].groupby("zone_id", sort=False)["speed_m_s"].agg(
-        in_count="count", in_speed_mean="mean",
-    ).reset_index()
-    out_stats = df[out_mask].groupby("zone_id", sort=False)["speed_m_s"].agg(
-        out_count="count", out_speed_mean="mean",
-    ).reset_index()
-
-    trans = (
-        df[out_mask]
-          .groupby(["zone_id","next_zone"], sort=False)
-          .size().reset_index(name="cnt")
-    )
-    total = trans.groupby("zone_id", sort=False)["cnt"].sum().reset_index(name="total")
-    trans = trans.merge(total, on="zone_id")
-    trans["p"] = trans["cnt"] / trans["total"]
-    trans_entropy = (
-        trans.groupby("zone_id", sort=False)
-             .apply(lambda g: -(g["p"] * np.log2(g["p"])).sum())
-             .reset_index(name="trans_entropy")
-    )
+    # ── transition profiles (per zone, across all time bins) ──
+    zc, nz = factorize_keys(zone)
+    dc = np.ones(n, dtype=bool)
+    dc[1:] = dev[1:] != dev[:-1]
+    last = np.roll(dc, -1)
+    if n:
+        last[-1] = True
+    zc_prev = np.roll(zc, 1)
+    zc_next = np.roll(zc, -1)
+    in_mask  = dc | (zc != zc_prev)
+    out_mask = last | (zc != zc_next)
+
+    in_mask_v  = in_mask & valid
+    out_mask_v = out_mask & valid
+    in_count  = np.bincount(zc[in_mask_v], minlength=nz)
+    out_count = np.bincount(zc[out_mask_v], minlength=nz)
+    in_speed_mean  = segment_mean(zc[in_mask_v], speed[in_mask_v], nz)
+    out_speed_mean = segment_mean(zc[out_mask_v], speed[out_mask_v], nz)
+
+    hop = out_mask & ~last
+    edge, nedge = factorize_keys(zc[hop], zc_next[hop])
+    edge_zone = zc[hop][first_index(edge, nedge)]
+    trans_entropy = np.zeros(nz)
+    if nedge:
+        ent = segment_entropy(edge_zone, np.bincount(edge, minlength=nedge).astype("float64"), nz)
+        seen = np.bincount(edge_zone, minlength=nz) > 0
+        trans_entropy[seen] = ent[seen]
     logger.info("   • Transition profiles computed")
 
-    time_bins = np.sort(df["time_bin"].unique())
-    time_flags = pd.DataFrame({
-        "time_bin": time_bins,
+    # ── assemble in the historical column order ──
+    gz = zc[first]
+    time_bins = tbin[first]
+    feat = pd.DataFrame({
+        "zone_id":        zone[first],
+        "time_bin":       time_bins,
+        "speed_mean":     speed_mean,
+        "speed_median":   segment_quantile(spd_sorted, starts, counts, 0.5),
+        "speed_min":      speed_min,
+        "speed_max":      speed_max,
+        "speed_var":      segment_var(gv, sv, ng, mean=speed_mean),
+        "speed_q25":      segment_quantile(spd_sorted, starts, counts, 0.25),
+        "speed_q75":      segment_quantile(spd_sorted, starts, counts, 0.75),
+        "ping_count":     ping_count,
+        "unique_devs":    unique_devs,
+        "pings_per_dev":  ping_count / unique_devs,
+        "dev_entropy":    segment_entropy(pair_group, pair_count.astype("float64"), ng),
+        "dwell_mean":     segment_mean(pair_group, dwell_s, ng),
+        "dwell_median":   segment_quantile(dwell_sorted, d_starts, d_counts, 0.5),
+        "dwell_min":      dwell_min,
+        "dwell_max":      dwell_max,
+        "in_count":       in_count[gz],
+        "in_speed_mean":  in_speed_mean[gz],
+        "out_count":      out_count[gz],
+        "out_speed_mean": out_speed_mean[gz],
+        "trans_entropy":  trans_entropy[gz],
         "is_morning_commute": np.isin(time_bins, [7,8,9]),
         "is_evening_commute": np.isin(time_bins, [16,17,18]),
         "is_late_night":      (time_bins <= 5),
+        "prior_walk":     0.5,
+        "prior_car":      0.5,
     })
     logger.info("   • Temporal flags set")
-
-    zone_priors = speed_stats[["zone_id"]].drop_duplicates().assign(
-        prior_walk=0.5, prior_car=0.5
-    )
-    logger.info("   • Zone-mode priors loaded")
-
-    feat = (
-        speed_stats
-        .merge(density,      on=["zone_id","time_bin"], how="left")
-        .merge(entropy,      on=["zone_id","time_bin"], how="left")
-        .merge(dwell_stats,  on=["zone_id","time_bin"], how="left")
-        .merge(in_stats,     on="zone_id",             how="left")
-        .merge(out_stats,    on="zone_id",             how="left")
-        .merge(trans_entropy,on="zone_id",             how="left")
-        .merge(time_flags,   on="time_bin",            how="left")
-        .merge(zone_priors,  on="zone_id",             how="left")
-    )
     feat.fillna(0, inplace=True)
-    logger.info(f"✔ Assembled features: {feat.shape[0]:,} rows × {feat.shape[1]} cols")
+    return feat
 
-    # ───────────────────────── Summarize & Preview ─────────────────────────
-    buf = io.StringIO()
-    feat.info(buf=buf)
-    logger.info("▶ Feature schema & non-null counts:\n" + buf.getvalue())
 
+def features_path(fp: Path) -> Path:
+    return FEATS_DIR / f"{fp.stem}_features.parquet"
 
-    logger.info("▶ First 200 rows (sorted by zone_id):")
-    pd.set_option('display.max_columns', None)
-    logger.info("\n" + feat.sort_values("zone_id").head(200).to_string(index=False))
-    pd.reset_option('display.max_columns')
 
-    # ───────────────────────── Save Output ─────────────────────────
-    out_fp = FEATS_DIR / f"{stem}_features.parquet"
-    feat.to_parquet(out_fp, index=False)
+def process_file(fp: Path, cache: StageCache = None, debug: bool = False):
+    stem = fp.stem
+    logger.info(f"▶ Processing {fp.name}")
+    with Lap() as day_lap, Lap() as lap:
+        df = pd.read_parquet(fp, columns=COLUMNS)
+        rows_in, devices_in = len(df), df["deviceid"].nunique()
+        logger.info(f"   • Loaded {len(df):,} rows across "
+                    f"{df['zone_id'].nunique():,} zones and {df['time_bin'].nunique():,} time bins")
+        emit("bin_features", "read", fp, lap.split(), rows_out=rows_in, devices_out=devices_in)
+
+        # ───────────────────────── Compute Deltas ─────────────────────────
+        df = add_speeds(df)
+        logger.info("   • Computed per-ping speed_m_s")
+        emit("bin_features", "add_speeds", fp, lap.split(), rows_in=rows_in, rows_out=len(df))
+
+        # ───────────────────────── Feature Aggregation ─────────────────────────
+        feat = aggregate_features(df)
+        logger.info(f"✔ Assembled features: {feat.shape[0]:,} rows × {feat.shape[1]} cols")
+        emit("bin_features", "aggregate_features", fp, lap.split(), rows_in=len(df),
+             rows_out=len(feat))
+
+        # ───────────────────────── Summarize & Preview (--debug) ─────────────────────────
+        if debug:
+            buf = io.StringIO()
+            feat.info(buf=buf)
+            logger.info("▶ Feature schema & non-null counts:\n" + buf.getvalue())
+
+            logger.info("▶ First 200 rows (sorted by zone_id):")
+            pd.set_option('display.max_columns', None)
+            logger.info("\n" + feat.sort_values("zone_id").head(200).to_string(index=False))
+            pd.reset_option('display.max_columns')
+
+        # ───────────────────────── Save Output ─────────────────────────
+        out_fp = features_path(fp)
+        feat.to_parquet(out_fp, index=False)
+        if cache is not None:
+            cache.record(out_fp, [fp])
+        emit("bin_features", "write", fp, lap.split(), rows_in=len(feat), rows_out=len(feat))
+        emit("bin_features", "day", fp, day_lap.split(), rows_in=rows_in, rows_out=len(feat),
+             devices_in=devices_in)
     logger.info(f"✔ Saved features to {out_fp}\n\n")
 
 
+# ───────────────────────── Streaming Mode ─────────────────────────
+def stream_state(fp: Path, batch_rows: int = STREAM_BATCH_ROWS) -> ZoneHourState:
+    """
+    Fold a binned day into a ZoneHourState batch by batch.
+
+    data_binned files are written sorted by (deviceid, datetime), so only the
+    last device of a batch can continue into the next one; its rows are held
+    back and prepended to the following batch. Every device is therefore
+    aggregated whole, and peak memory is one batch plus the state.
+    """
+    state = ZoneHourState.empty()
+    carry = None
+    for batch in pq.ParquetFile(fp).iter_batches(batch_size=batch_rows, columns=COLUMNS):
+        df = batch.to_pandas()
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+        dev = df["deviceid"].to_numpy()
+        if (dev[1:] < dev[:-1]).any():
+            raise ValueError(f"{fp.name} is not sorted by deviceid; "
+                             "use the in-memory mode instead of --stream")
+        tail = dev == dev[-1]
+        carry = df[tail]
+        if not tail.all():
+            state = state.merge(ZoneHourState.from_frame(add_speeds(df[~tail])))
+    if carry is not None and len(carry):
+        state = state.merge(ZoneHourState.from_frame(add_speeds(carry)))
+    return state
+
+
+def process_file_streaming(fp: Path, batch_rows: int = STREAM_BATCH_ROWS,
+                           cache: StageCache = None):
+    logger.info(f"▶ Streaming {fp.name}")
+    with Lap() as day_lap, Lap() as lap:
+        rows_in = pq.ParquetFile(fp).metadata.num_rows
+        state = stream_state(fp, batch_rows)
+        state.save(STATE_DIR / fp.stem)
+        logger.info(f"   • State: {len(state):,} zone×hour bins, "
+                    f"{len(state.speed_sketch):,} speed sketch buckets")
+        emit("bin_features", "stream_state", fp, lap.split(), rows_in=rows_in, rows_out=len(state))
+
+        feat = state.finalize()
+        out_fp = features_path(fp)
+        feat.to_parquet(out_fp, index=False)
+        if cache is not None:
+            cache.record(out_fp, [fp])
+        emit("bin_features", "finalize", fp, lap.split(), rows_in=len(state), rows_out=len(feat))
+        emit("bin_features", "day", fp, day_lap.split(), rows_in=rows_in, rows_out=len(feat))
+    logger.info(f"✔ Saved features to {out_fp}\n\n")
+
+
+def merge_day_states(state_dirs, out_fp: Path = ALL_DAYS_FILE):
+    """
+    Pool saved per-day states into one feature table, without rereading pings.
+    Devices recur across days, so the device columns count device-days.
+    """
+    states = [ZoneHourState.load(d) for d in state_dirs]
+    if not states:
+        logger.warning(f"No saved states under {STATE_DIR}; run with --stream first")
+        return
+    feat = states[0].merge(*states[1:]).finalize(device_days=True)
+    feat.to_parquet(out_fp, index=False)
+    logger.info(f"✔ Merged {len(states)} day states into {out_fp} ({len(feat):,} rows)")
+
+
 if __name__ == "__main__":
-    for fp in BINS_DIR.glob("*.parquet"):
-        process_file(fp)
+    parser = argparse.ArgumentParser(description="Zone×hour feature extraction")
+    parser.add_argument("--stream", action="store_true",
+                        help="bounded-memory mode: aggregate batch by batch into mergeable "
+                             "state (approximate medians/quartiles)")
+    parser.add_argument("--batch-rows", type=int, default=STREAM_BATCH_ROWS)
+    parser.add_argument("--merge-days", action="store_true",
+                        help=f"merge the saved day states into {ALL_DAYS_FILE}")
+    parser.add_argument("--workers", type=int, default=N_WORKERS,
+                        help="days processed concurrently (default: SLURM_CPUS_PER_TASK)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every day, even those whose binned file is unchanged")
+    parser.add_argument("--debug", action="store_true",
+                        help="log each day's feature schema and a 200-row preview (slow)")
+    args = parser.parse_args()
+
+    if args.merge_days:
+        merge_day_states(sorted(p for p in STATE_DIR.glob("*") if p.is_dir()))
+    else:
+        # exact and streamed features differ, so the mode is part of the key
+        cache = StageCache("bin_features", {"mode": "stream" if args.stream else "exact"},
+                           force=args.force)
+        days = sorted(BINS_DIR.glob("*.parquet"))
+        todo = [inputs[0] for _, inputs in cache.pending([(features_path(fp), [fp]) for fp in days],
+                                                         label="days")]
+        if args.stream:
+            # a day whose state was removed is redone so --merge-days can see it
+            todo += [fp for fp in days if fp not in todo and not (STATE_DIR / fp.stem).is_dir()]
+            map_parallel(partial(process_file_streaming, batch_rows=args.batch_rows, cache=cache),
+                         todo, args.workers, MEM_PER_DAY_GB_STREAM, label="days")
+        else:
+            map_parallel(partial(process_file, cache=cache, debug=args.debug), todo, args.workers,
+                         MEM_PER_DAY_GB, label="days")
+        write_prometheus("bin_features")
@@ -0,0 +1,111 @@
+# coding: utf-8
+"""
+Frequency counts of exact (lat, lon) pairs.
+
+A float32 (lat, lon) pair is packed into one int64 key (lat bits in the high
+word, lon bits in the low word), so counting is one sort of a single integer
+column plus run lengths instead of a two-column float groupby.  Two
+pairs share a key exactly when their float32 values are equal (-0.0 counts as
+0.0); pairs with a NaN are never counted.
+
+`CoordCounts` keeps sorted unique keys with their counts.  Counters from
+shards or days merge by summing, and the frequent pairs can be persisted as a
+small parquet table and tested for membership with one searchsorted.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def pack_coords(lat, lon) -> tuple[np.ndarray, np.ndarray]:
+    """(keys, valid): int64 key per pair and False where lat or lon is NaN."""
+    lat = np.asarray(lat, dtype=np.float32) + np.float32(0)     # -0.0 → 0.0
+    lon = np.asarray(lon, dtype=np.float32) + np.float32(0)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    keys = (lat.view(np.uint32).astype(np.uint64) << np.uint64(32)) | lon.view(np.uint32)
+    return keys.view(np.int64), valid
+
+
+def unpack_coords(keys) -> tuple[np.ndarray, np.ndarray]:
+    keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+    lat = (keys >> np.uint64(32)).astype(np.uint32).view(np.float32)
+    lon = (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32).view(np.float32)
+    return lat, lon
+
+
+class CoordCounts:
+    def __init__(self, keys: np.ndarray, counts: np.ndarray):
+        self.keys = keys          # sorted, unique int64
+        self.counts = counts      # int64, aligned with keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_keys(cls, keys: np.ndarray, weights: np.ndarray | None = None) -> "CoordCounts":
+        """Sum ``weights`` (default 1) per distinct key; one sort plus run lengths."""
+        if weights is None:
+            keys = np.sort(keys)
+        else:
+            order = np.argsort(keys, kind="stable")
+            keys, weights = keys[order], weights[order]
+        if not len(keys):
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        if weights is None:
+            counts = np.diff(np.r_[starts, len(keys)])
+        else:
+            counts = np.add.reduceat(weights, starts)
+        return cls(keys[starts].astype(np.int64), counts.astype(np.int64))
+
+    @classmethod
+    def from_coords(cls, lat, lon) -> "CoordCounts":
+        keys, valid = pack_coords(lat, lon)
+        return cls.from_keys(keys[valid])
+
+    def merge(self, *others: "CoordCounts") -> "CoordCounts":
+        parts = (self, *others)
+        return CoordCounts.from_keys(np.concatenate([p.keys for p in parts]),
+                                     np.concatenate([p.counts for p in parts]))
+
+    def frequent(self, min_count: int) -> "CoordCounts":
+        keep = self.counts >= min_count
+        return CoordCounts(self.keys[keep], self.counts[keep])
+
+    def count_of(self, lat, lon) -> np.ndarray:
+        """Stored count of every (lat, lon) pair (0 if absent)."""
+        keys, valid = pack_coords(lat, lon)
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = valid & (self.keys[pos] == keys)
+        return np.where(hit, self.counts[pos], 0)
+
+    def contains(self, lat, lon) -> np.ndarray:
+        return self.count_of(lat, lon) > 0
+
+    # ───────────── persistence ─────────────
+
+    def to_frame(self) -> pd.DataFrame:
+        lat, lon = unpack_coords(self.keys)
+        return pd.DataFrame({"lat": lat, "lon": lon, "count": self.counts})
+
+    def save(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.to_frame().to_parquet(path, index=False)
+
+    @classmethod
+    def load(cls, path: Path) -> "CoordCounts":
+        df = pd.read_parquet(path)
+        keys, _ = pack_coords(df["lat"].to_numpy(), df["lon"].to_numpy())
+        return cls.from_keys(keys, df["count"].to_numpy(np.int64))
+
+    @classmethod
+    def load_many(cls, paths) -> "CoordCounts":
+        """Merged counts of every saved table in ``paths`` (empty if none)."""
+        counters = [cls.load(p) for p in paths]
+        if not counters:
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        return counters[0].merge(*counters[1:])
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Dataset statistics of ping files (raw, binned or denoised) in one pass.
+
+Row counts come from the parquet footers.  Everything else is computed in
+a single vectorized pass per row group, which reduces each row to a device
+hash and a timestamp in seconds.  At the end of the day one sort of these
+compact arrays (16 bytes per ping) gives the exact sampling intervals and
+points per device.
+
+    rows / total_points     footer row count / rows without nulls
+    unique_devices          exact set of device hashes, or a HyperLogLog
+                            sketch (hll_precision) when only an estimate
+                            is needed across many days
+    sampling interval       mean / median / std of deltas within a device
+    bbox, day/night ratio, hours covered, null counts per column
+
+`DatasetState` is mergeable: the weekly summary is the merge of the
+per-day states (distinct devices across the week, pooled interval moments,
+joint bbox), not a sum of daily figures.
+
+Usage:
+    python dataset_stats.py data/2023*.parquet
+    python dataset_stats.py data_binned/*.parquet --hll 14
+"""
+
+import argparse
+import logging
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from parallel import N_WORKERS, map_parallel
+
+DAY_HOURS      = (6, 20)          # daytime: hour 6 to hour 20 inclusive
+KM_PER_DEG     = 111
+MEM_PER_DAY_GB = 4                # peak per worker for a full raw day
+COLUMNS        = ["deviceid", "datetime", "lat", "lon"]
+
+logger = logging.getLogger(__name__)
+
+_EPOCH_1900 = -2_208_988_800      # strptime("%H:%M:%S") is relative to 1900-01-01
+
+
+# ───────────── HyperLogLog ─────────────
+
+def hll_registers(hashes: np.ndarray, precision: int) -> np.ndarray:
+    """HyperLogLog registers (2**precision uint8) of 64-bit hashes."""
+    m = 1 << precision
+    regs = np.zeros(m, dtype=np.uint8)
+    if len(hashes):
+        idx = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        w = ((hashes >> np.uint64(32 - precision)) & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        rank = np.where(w > 0, 32 - np.floor(np.log2(np.maximum(w, 1))), 33).astype(np.uint8)
+        np.maximum.at(regs, idx, rank)
+    return regs
+
+
+def hll_estimate(regs: np.ndarray) -> int:
+    m = len(regs)
+    est = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -regs.astype(np.int64)))
+    zeros = int((regs == 0).sum())
+    if est <= 2.5 * m and zeros:
+        est = m * np.log(m / zeros)              # linear counting for small cardinalities
+    return int(round(est))
+
+
+# ───────────── state ─────────────
+
+class DatasetState:
+    """Mergeable statistics of one or more days of pings."""
+
+    def __init__(self, hll_precision: int | None = None):
+        self.hll_precision = hll_precision
+        self.rows = 0                     # footer row count
+        self.points = 0                   # rows without nulls
+        self.day_points = 0
+        self.nulls = dict.fromkeys(COLUMNS, 0)
+        self.t_min = self.lat_min = self.lon_min = np.inf
+        self.t_max = self.lat_max = self.lon_max = -np.inf
+        self.devices = (np.empty(0, dtype=np.uint64) if hll_precision is None
+                        else np.zeros(1 << hll_precision, dtype=np.uint8))
+        self.days = set()
+        self.hours = 0.0                  # sum of the per-day time spans
+        self.device_days = 0              # sum of the per-day device counts
+        self.iv_n, self.iv_mean, self.iv_m2 = 0, 0.0, 0.0
+
+    @property
+    def n_devices(self) -> int:
+        if self.hll_precision is None:
+            return len(self.devices)
+        return hll_estimate(self.devices)
+
+    def update(self, secs, lat, lon) -> None:
+        """Fold in rows without nulls (epoch seconds, lat, lon)."""
+        if not len(secs):
+            return
+        self.points += len(secs)
+        self.t_min = min(self.t_min, secs.min()); self.t_max = max(self.t_max, secs.max())
+        self.lat_min = min(self.lat_min, lat.min()); self.lat_max = max(self.lat_max, lat.max())
+        self.lon_min = min(self.lon_min, lon.min()); self.lon_max = max(self.lon_max, lon.max())
+        hour = secs % 86_400 // 3600
+        self.day_points += int(((hour >= DAY_HOURS[0]) & (hour <= DAY_HOURS[1])).sum())
+
+    def add_intervals(self, deltas: np.ndarray) -> None:
+        n = len(deltas)
+        if not n:
+            return
+        mean = deltas.mean()
+        self._merge_moments(n, mean, float(((deltas - mean) ** 2).sum()))
+
+    def _merge_moments(self, n, mean, m2) -> None:
+        # Chan et al.: M2 = M2_a + M2_b + δ² n_a n_b / n
+        total = self.iv_n + n
+        delta = mean - self.iv_mean
+        self.iv_m2 += m2 + delta * delta * self.iv_n * n / total
+        self.iv_mean += delta * n / total
+        self.iv_n = total
+
+    def merge(self, *others: "DatasetState") -> "DatasetState":
+        """Combine states of different files or days (in place; returns self)."""
+        for o in others:
+            if o.hll_precision != self.hll_precision:
+                raise ValueError("Cannot merge exact and HyperLogLog device counts "
+                                 "or sketches of different precision")
+            self.rows += o.rows; self.points += o.points; self.day_points += o.day_points
+            for col, n in o.nulls.items():
+                self.nulls[col] += n
+            self.t_min = min(self.t_min, o.t_min); self.t_max = max(self.t_max, o.t_max)
+            self.lat_min = min(self.lat_min, o.lat_min); self.lat_max = max(self.lat_max, o.lat_max)
+            self.lon_min = min(self.lon_min, o.lon_min); self.lon_max = max(self.lon_max, o.lon_max)
+            self.devices = (np.union1d(self.devices, o.devices) if self.hll_precision is None
+                            else np.maximum(self.devices, o.devices))
+            self.days |= o.days
+            self.hours += o.hours
+            self.device_days += o.device_days
+            if o.iv_n:
+                self._merge_moments(o.iv_n, o.iv_mean, o.iv_m2)
+        return self
+
+    def summary(self) -> dict:
+        """Statistics shared by the daily and the merged summaries."""
+        has = self.points > 0
+        lat_span = self.lat_max - self.lat_min if has else 0.0
+        lon_span = self.lon_max - self.lon_min if has else 0.0
+        day_ratio = self.day_points / self.points * 100 if has else float("nan")
+        return {
+            "total_points": self.points,
+            "rows_in_files": self.rows,
+            "mean_sampling_interval_s": round(float(self.iv_mean), 2) if self.iv_n else float("nan"),
+            "std_sampling_interval_s": (round(float(np.sqrt(self.iv_m2 / (self.iv_n - 1))), 2)
+                                        if self.iv_n > 1 else float("nan")),
+            "day_ratio_%": round(day_ratio, 2),
+            "night_ratio_%": round(100 - day_ratio, 2),
+            "lat_min": float(self.lat_min) if has else None,
+            "lat_max": float(self.lat_max) if has else None,
+            "lon_min": float(self.lon_min) if has else None,
+            "lon_max": float(self.lon_max) if has else None,
+            "area_est_km2": round(float(lat_span * lon_span) * KM_PER_DEG * KM_PER_DEG, 2),
+            "null_counts": dict(self.nulls),
+        }
+
+
+# ───────────── scanning ─────────────
+
+def _device_hashes(col: pa.ChunkedArray) -> np.ndarray:
+    """Stable 64-bit hash per row; dictionary columns hash each distinct value once."""
+    parts = []
+    for chunk in col.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            values = pd.util.hash_array(chunk.dictionary.to_numpy(zero_copy_only=False))
+            parts.append(values[chunk.indices.fill_null(0).to_numpy()])
+        else:
+            parts.append(pd.util.hash_array(chunk.to_numpy(zero_copy_only=False)))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.uint64)
+
+
+def _epoch_seconds(table: pa.Table, day: pd.Timestamp | None) -> pa.Array:
+    """Seconds since the epoch per row, null where the time cannot be parsed."""
+    if "datetime" in table.column_names:
+        return pc.cast(pc.cast(table["datetime"], pa.timestamp("s"), safe=False), pa.int64())
+    tod = pc.strptime(pc.cast(table["time"], pa.string()), format="%H:%M:%S",
+                      unit="s", error_is_null=True)
+    tod = pc.subtract(pc.cast(tod, pa.int64()), _EPOCH_1900)
+    if day is not None:
+        return pc.add(tod, int(day.timestamp()))
+    date = pc.strptime(pc.cast(table["date"], pa.string()), format="%d.%m.%Y",
+                       unit="s", error_is_null=True)
+    return pc.add(pc.cast(date, pa.int64()), tod)
+
+
+def _file_day(path: Path) -> pd.Timestamp | None:
+    stem = path.stem
+    return pd.Timestamp(stem) if len(stem) == 8 and stem.isdigit() else None
+
+
+def scan_file(path: Path, hll_precision: int | None = None) -> tuple[dict, DatasetState]:
+    """
+    Statistics of one file: (summary row, mergeable state).
+
+    Raw files (date/time strings) take their day from a YYYYMMDD file name
+    and fall back to the date column; binned and denoised files use datetime.
+    """
+    path = Path(path)
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    time_cols = ["datetime"] if "datetime" in names else ["date", "time"] if "date" in names \
+        else ["time"]
+    day = None if "datetime" in names else _file_day(path)
+    state = DatasetState(hll_precision)
+    state.rows = pf.metadata.num_rows
+
+    hashes, secs = [], []
+    for i in range(pf.num_row_groups):
+        table = pf.read_row_group(i, columns=["deviceid", *time_cols, "lat", "lon"])
+        t = _epoch_seconds(table, day)
+        cols = {"deviceid": table["deviceid"], "datetime": t,
+                "lat": table["lat"], "lon": table["lon"]}
+        valid = np.ones(table.num_rows, dtype=bool)
+        for name, col in cols.items():
+            null = col.is_null().to_numpy(zero_copy_only=False)
+            if name in ("lat", "lon"):
+                null |= np.isnan(col.to_numpy(zero_copy_only=False).astype(np.float64))
+            state.nulls[name] += int(null.sum())
+            valid &= ~null
+        h = _device_hashes(table["deviceid"])[valid]
+        s = t.to_numpy(zero_copy_only=False)[valid].astype(np.int64)
+        state.update(s, table["lat"].to_numpy().astype(np.float64)[valid],
+                     table["lon"].to_numpy().astype(np.float64)[valid])
+        hashes.append(h)
+        secs.append(s)
+
+    h = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+    s = np.concatenate(secs) if secs else np.empty(0, dtype=np.int64)
+    order = np.lexsort((s, h))
+    h, s = h[order], s[order]
+    new_dev = np.ones(len(h), dtype=bool)
+    new_dev[1:] = h[1:] != h[:-1]
+    deltas = np.diff(s)[~new_dev[1:]].astype(np.float64)
+    counts = np.diff(np.append(np.flatnonzero(new_dev), len(h)))
+    state.add_intervals(deltas)
+
+    uniques = h[new_dev]
+    state.devices = uniques if hll_precision is None else hll_registers(uniques, hll_precision)
+    n_dev = len(uniques)
+    if state.points:
+        state.days.add(pd.Timestamp(int(state.t_min), unit="s").date().isoformat())
+        state.hours = float(state.t_max - state.t_min) / 3600
+    state.device_days = n_dev
+
+    row = {
+        "file": path.name,
+        "date": min(state.days) if state.days else None,
+        "unique_devices": n_dev,
+        "avg_points_per_device": round(state.points / n_dev, 2) if n_dev else 0,
+        "median_points_per_device": float(np.median(counts)) if n_dev else float("nan"),
+        "std_points_per_device": float(np.std(counts, ddof=1)) if n_dev > 1 else float("nan"),
+        "median_sampling_interval_s": (round(float(np.median(deltas)), 2) if len(deltas)
+                                       else float("nan")),
+        "hours_covered": round(state.hours, 2),
+        **state.summary(),
+    }
+    return row, state
+
+
+def dataset_stats(files, hll_precision: int | None = None,
+                  workers: int = N_WORKERS) -> tuple[pd.DataFrame, dict]:
+    """
+    Scan ``files`` in parallel (one task per file) and merge their states.
+
+    Returns:
+        (one summary row per file, summary of the merged state).
+    """
+    files = [Path(f) for f in files]
+    if not files:
+        raise FileNotFoundError("No files to scan")
+    results = map_parallel(partial(scan_file, hll_precision=hll_precision), files, workers,
+                           mem_per_worker_gb=MEM_PER_DAY_GB, label="files")
+    rows, states = zip(*results)
+    return pd.DataFrame(list(rows)), merged_summary(DatasetState(hll_precision).merge(*states))
+
+
+def merged_summary(state: DatasetState) -> dict:
+    """Summary of a merged state: distinct devices over all days, per-day averages."""
+    n_days = max(len(state.days), 1)
+    days = sorted(state.days)
+    return {
+        "date_range": f"{days[0]} → {days[-1]}" if days else None,
+        "days": len(state.days),
+        "unique_devices_total": state.n_devices,
+        "avg_points_per_day": round(state.points / n_days, 2),
+        "avg_devices_per_day": round(state.device_days / n_days, 2),
+        "total_hours_covered": round(state.hours, 2),
+        **state.summary(),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Single-pass statistics of ping files")
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--hll", type=int, metavar="PRECISION",
+                        help="estimate distinct devices with a HyperLogLog sketch")
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    args = parser.parse_args()
+    daily, merged = dataset_stats(args.files, args.hll, args.workers)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(daily.drop(columns=["null_counts"]))
+    print(pd.Series(merged).to_string())
@@ -0,0 +1,332 @@
+# coding: utf-8
+"""
+Mergeable per-(zone_id, time_bin) state for the zone×hour feature table.
+
+The state only holds sufficient statistics: moment accumulators and exact
+min/max, Σ c·log2(c) over per-device ping counts (device entropy), log-bucket
+quantile sketches for speed and dwell, and per-zone transition counts.  Its
+size therefore depends on the number of zones, not on the number of pings.
+
+States built from disjoint sets of devices (batches of one day, shards)
+combine with `ZoneHourState.merge`, and `finalize` turns any state into the
+columns produced by `binning_insights.aggregate_features`.  Means, variances,
+min/max, counts and entropies are exact; medians and quartiles come from the
+sketch and are within `SKETCH_ALPHA` relative error.
+
+Whole days merge the same way, but device codes are global, so days share
+devices and the state cannot tell them apart: a device seen on two days
+counts twice.  The device columns of a multi-day table are therefore per
+device-day, and `finalize(device_days=True)` names them accordingly
+(`DEVICE_DAY_COLUMNS`); everything else is unaffected.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from segments import factorize_keys, first_index, segment_layout, segment_sort
+
+SKETCH_ALPHA = 0.01                       # relative accuracy of the quantile sketch
+_ZERO_BUCKET = np.iinfo(np.int32).min     # bucket for values <= 0
+
+KEYS = ["zone_id", "time_bin"]
+
+# Device columns of a table merged across days, where devices repeat
+DEVICE_DAY_COLUMNS = {
+    "unique_devs":   "device_days",
+    "pings_per_dev": "pings_per_device_day",
+    "dev_entropy":   "device_day_entropy",
+}
+
+_BIN_AGG = {
+    "ping_count":  "sum",
+    "n_speed":     "sum",
+    "speed_sum":   "sum",
+    "speed_m2":    "sum",
+    "speed_min":   "min",
+    "speed_max":   "max",
+    "unique_devs": "sum",
+    "dev_clogc":   "sum",
+    "dwell_sum":   "sum",
+    "dwell_min":   "min",
+    "dwell_max":   "max",
+}
+_ZONE_COLS = ["in_count", "in_speed_sum", "out_count", "out_speed_sum"]
+
+
+# ───────────────────────── log-bucket sketch ─────────────────────────
+
+def sketch_buckets(values: np.ndarray, alpha: float = SKETCH_ALPHA) -> np.ndarray:
+    """Map non-negative values to log-spaced buckets (DDSketch-style)."""
+    gamma = (1 + alpha) / (1 - alpha)
+    buckets = np.full(len(values), _ZERO_BUCKET, dtype=np.int32)
+    pos = values > 0
+    buckets[pos] = np.ceil(np.log(values[pos]) / np.log(gamma)).astype(np.int32)
+    return buckets
+
+
+def bucket_values(buckets: np.ndarray, alpha: float = SKETCH_ALPHA) -> np.ndarray:
+    """Representative value of every bucket (relative error <= alpha)."""
+    gamma = (1 + alpha) / (1 - alpha)
+    out = np.zeros(len(buckets))
+    pos = buckets != _ZERO_BUCKET
+    out[pos] = 2 * gamma ** buckets[pos].astype("float64") / (gamma + 1)
+    return out
+
+
+def _sketch_frame(zone, tbin, values) -> pd.DataFrame:
+    sk = pd.DataFrame({"zone_id": zone, "time_bin": tbin, "bucket": sketch_buckets(values)})
+    return sk.groupby(["zone_id", "time_bin", "bucket"], sort=False).size().reset_index(name="count")
+
+
+def _sketch_quantiles(sketch: pd.DataFrame, index: pd.MultiIndex, qs) -> list[np.ndarray]:
+    """Linear-interpolated quantiles per (zone_id, time_bin) of ``index``."""
+    ng = len(index)
+    code = index.get_indexer(pd.MultiIndex.from_arrays([sketch["zone_id"], sketch["time_bin"]]))
+    order = segment_sort(code, sketch["bucket"].to_numpy())
+    code = code[order]
+    cnt = sketch["count"].to_numpy()[order]
+    vals = bucket_values(sketch["bucket"].to_numpy()[order])
+
+    cum = np.cumsum(cnt)
+    total = np.bincount(code, weights=cnt, minlength=ng).astype(np.int64)
+    starts, rows = segment_layout(code, ng)
+    base = np.zeros(ng, dtype=np.int64)
+    ok = rows > 0
+    base[ok] = cum[starts[ok]] - cnt[starts[ok]]
+
+    out = []
+    for q in qs:
+        res = np.full(ng, np.nan)
+        pos = q * (total[ok] - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, total[ok] - 1)
+        a = vals[np.searchsorted(cum, base[ok] + lo, side="right")]
+        b = vals[np.searchsorted(cum, base[ok] + hi, side="right")]
+        res[ok] = a + (b - a) * (pos - lo)
+        out.append(res)
+    return out
+
+
+# ───────────────────────── mergeable state ─────────────────────────
+
+class ZoneHourState:
+    """Sufficient statistics for the zone×hour features of a set of devices."""
+
+    def __init__(self, bins: pd.DataFrame, speed_sketch: pd.DataFrame,
+                 dwell_sketch: pd.DataFrame, zones: pd.DataFrame, edges: pd.DataFrame):
+        self.bins = bins
+        self.speed_sketch = speed_sketch
+        self.dwell_sketch = dwell_sketch
+        self.zones = zones
+        self.edges = edges
+
+    @classmethod
+    def empty(cls) -> "ZoneHourState":
+        return cls(pd.DataFrame(columns=KEYS + list(_BIN_AGG)),
+                   pd.DataFrame(columns=KEYS + ["bucket", "count"]),
+                   pd.DataFrame(columns=KEYS + ["bucket", "count"]),
+                   pd.DataFrame(columns=["zone_id"] + _ZONE_COLS),
+                   pd.DataFrame(columns=["zone_id", "next_zone", "count"]))
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ZoneHourState":
+        """
+        Build the state of complete devices.
+
+        ``df`` must be the output of `binning_insights.add_speeds` (sorted by
+        deviceid, datetime) and hold *all* pings of every device it contains.
+        """
+        zone  = df["zone_id"].to_numpy()
+        tbin  = df["time_bin"].to_numpy()
+        dev   = df["deviceid"].to_numpy()
+        speed = df["speed_m_s"].to_numpy(dtype="float64")
+        t_ns  = df["datetime"].to_numpy().astype("int64")
+        n     = len(df)
+
+        g, ng = factorize_keys(zone, tbin)
+        first = first_index(g, ng)
+        valid = ~np.isnan(speed)
+        gv, sv = g[valid], speed[valid]
+
+        n_speed = np.bincount(gv, minlength=ng)
+        speed_sum = np.bincount(gv, weights=sv, minlength=ng)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = speed_sum / n_speed
+        dev_sq = (sv - mean[gv]) ** 2
+        speed_min = np.full(ng, np.nan)
+        speed_max = np.full(ng, np.nan)
+        np.fmin.at(speed_min, gv, sv)
+        np.fmax.at(speed_max, gv, sv)
+
+        # per (bin, device) pair: ping count and dwell
+        pair, npair = factorize_keys(g, dev)
+        pair_group = g[first_index(pair, npair)]
+        pair_count = np.bincount(pair, minlength=npair)
+        p_order = segment_sort(pair)
+        p_starts, p_counts = segment_layout(pair[p_order], npair)
+        t_sorted = t_ns[p_order]
+        dwell_s = (t_sorted[p_starts + p_counts - 1] - t_sorted[p_starts]) / 1e9
+        dwell_min = np.full(ng, np.nan)
+        dwell_max = np.full(ng, np.nan)
+        np.fmin.at(dwell_min, pair_group, dwell_s)
+        np.fmax.at(dwell_max, pair_group, dwell_s)
+
+        bins = pd.DataFrame({
+            "zone_id":     zone[first],
+            "time_bin":    tbin[first],
+            "ping_count":  np.bincount(g, minlength=ng),
+            "n_speed":     n_speed,
+            "speed_sum":   speed_sum,
+            "speed_m2":    np.bincount(gv, weights=dev_sq, minlength=ng),
+            "speed_min":   speed_min,
+            "speed_max":   speed_max,
+            "unique_devs": np.bincount(pair_group, minlength=ng),
+            "dev_clogc":   np.bincount(pair_group, weights=pair_count * np.log2(pair_count),
+                                       minlength=ng),
+            "dwell_sum":   np.bincount(pair_group, weights=dwell_s, minlength=ng),
+            "dwell_min":   dwell_min,
+            "dwell_max":   dwell_max,
+        })
+
+        # per-zone entries/exits and zone → next-zone hops
+        dc = np.ones(n, dtype=bool)
+        dc[1:] = dev[1:] != dev[:-1]
+        last = np.roll(dc, -1)
+        if n:
+            last[-1] = True
+        zone_next = np.roll(zone, -1)
+        in_mask  = (dc | (zone != np.roll(zone, 1))) & valid
+        out_mask = last | (zone != zone_next)
+        in_s  = pd.DataFrame({"zone_id": zone[in_mask], "in_speed_sum": speed[in_mask]})
+        out_v = out_mask & valid
+        out_s = pd.DataFrame({"zone_id": zone[out_v], "out_speed_sum": speed[out_v]})
+        zones = pd.concat([
+            in_s.groupby("zone_id")["in_speed_sum"].agg(in_count="size", in_speed_sum="sum"),
+            out_s.groupby("zone_id")["out_speed_sum"].agg(out_count="size", out_speed_sum="sum"),
+        ], axis=1).fillna(0).reset_index()
+
+        hop = out_mask & ~last
+        edges = (pd.DataFrame({"zone_id": zone[hop], "next_zone": zone_next[hop]})
+                   .groupby(["zone_id", "next_zone"], sort=False).size()
+                   .reset_index(name="count"))
+
+        return cls(bins,
+                   _sketch_frame(zone[valid], tbin[valid], sv),
+                   _sketch_frame(bins["zone_id"].to_numpy()[pair_group],
+                                 bins["time_bin"].to_numpy()[pair_group], dwell_s),
+                   zones, edges)
+
+    # ───────────── combining ─────────────
+
+    def merge(self, *others: "ZoneHourState") -> "ZoneHourState":
+        """Combine states of disjoint device sets (batches, shards), or of days."""
+        states = [s for s in (self, *others) if len(s)]
+        if len(states) <= 1:
+            return states[0] if states else self
+
+        cat = pd.concat([s.bins for s in states], ignore_index=True)
+        # Chan et al.: M2 = Σ M2_i + Σ n_i (mean_i - mean)²
+        grp = cat.groupby(KEYS, sort=False)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_i = cat["speed_sum"] / cat["n_speed"]
+            mean = grp["speed_sum"].transform("sum") / grp["n_speed"].transform("sum")
+        cat["speed_m2"] += (cat["n_speed"] * (mean_i - mean) ** 2).fillna(0)
+        bins = cat.groupby(KEYS, sort=False, as_index=False).agg(_BIN_AGG)
+
+        def _sum(frames, keys):
+            return (pd.concat(frames, ignore_index=True)
+                      .groupby(keys, sort=False, as_index=False).sum())
+
+        return ZoneHourState(
+            bins,
+            _sum([s.speed_sketch for s in states], KEYS + ["bucket"]),
+            _sum([s.dwell_sketch for s in states], KEYS + ["bucket"]),
+            _sum([s.zones for s in states], ["zone_id"]),
+            _sum([s.edges for s in states], ["zone_id", "next_zone"]),
+        )
+
+    # ───────────── output ─────────────
+
+    def finalize(self, device_days: bool = False) -> pd.DataFrame:
+        """
+        Feature table with the columns of `aggregate_features`, sorted by key.
+        With ``device_days`` (a state merged across days) the device columns
+        are renamed per `DEVICE_DAY_COLUMNS`.
+        """
+        b = self.bins.sort_values(KEYS, ignore_index=True)
+        index = pd.MultiIndex.from_arrays([b["zone_id"], b["time_bin"]])
+        speed_median, speed_q25, speed_q75 = _sketch_quantiles(
+            self.speed_sketch, index, (0.5, 0.25, 0.75))
+        (dwell_median,) = _sketch_quantiles(self.dwell_sketch, index, (0.5,))
+
+        n = b["n_speed"].to_numpy()
+        pings = b["ping_count"].to_numpy()
+        devs = b["unique_devs"].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            speed_mean = b["speed_sum"].to_numpy() / n
+            speed_var = np.where(n > 1, b["speed_m2"].to_numpy() / (n - 1), np.nan)
+            dev_entropy = np.log2(pings) - b["dev_clogc"].to_numpy() / pings
+
+        zones = self.zones.set_index("zone_id")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            zones["in_speed_mean"] = zones["in_speed_sum"] / zones["in_count"]
+            zones["out_speed_mean"] = zones["out_speed_sum"] / zones["out_count"]
+        e = self.edges
+        p = e["count"] / e.groupby("zone_id")["count"].transform("sum")
+        zones["trans_entropy"] = (-(p * np.log2(p))).groupby(e["zone_id"]).sum()
+        z = zones.reindex(b["zone_id"])
+
+        time_bins = b["time_bin"].to_numpy()
+        feat = pd.DataFrame({
+            "zone_id":        b["zone_id"],
+            "time_bin":       b["time_bin"],
+            "speed_mean":     speed_mean,
+            "speed_median":   speed_median,
+            "speed_min":      b["speed_min"],
+            "speed_max":      b["speed_max"],
+            "speed_var":      speed_var,
+            "speed_q25":      speed_q25,
+            "speed_q75":      speed_q75,
+            "ping_count":     pings,
+            "unique_devs":    devs,
+            "pings_per_dev":  pings / devs,
+            "dev_entropy":    dev_entropy,
+            "dwell_mean":     b["dwell_sum"].to_numpy() / devs,
+            "dwell_median":   dwell_median,
+            "dwell_min":      b["dwell_min"],
+            "dwell_max":      b["dwell_max"],
+            "in_count":       z["in_count"].to_numpy(),
+            "in_speed_mean":  z["in_speed_mean"].to_numpy(),
+            "out_count":      z["out_count"].to_numpy(),
+            "out_speed_mean": z["out_speed_mean"].to_numpy(),
+            "trans_entropy":  z["trans_entropy"].to_numpy(),
+            "is_morning_commute": np.isin(time_bins, [7,8,9]),
+            "is_evening_commute": np.isin(time_bins, [16,17,18]),
+            "is_late_night":      (time_bins <= 5),
+            "prior_walk":     0.5,
+            "prior_car":      0.5,
+        })
+        feat.fillna(0, inplace=True)
+        for col in ("ping_count", "unique_devs", "in_count", "out_count"):
+            feat[col] = feat[col].astype("int64")
+        if device_days:
+            feat.rename(columns=DEVICE_DAY_COLUMNS, inplace=True)
+        return feat
+
+    # ───────────── persistence ─────────────
+
+    _PARTS = ("bins", "speed_sketch", "dwell_sketch", "zones", "edges")
+
+    def save(self, out_dir: Path) -> None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for part in self._PARTS:
+            getattr(self, part).to_parquet(out_dir / f"{part}.parquet", index=False)
+
+    @classmethod
+    def load(cls, state_dir: Path) -> "ZoneHourState":
+        return cls(*(pd.read_parquet(state_dir / f"{part}.parquet") for part in cls._PARTS))
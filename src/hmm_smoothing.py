@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+Batched log-space Viterbi smoothing of per-bin labels.
+
+Rows are sorted by (zone_id, time_bin) and every zone is one sequence.  All
+sequences are decoded together: step t updates every sequence longer than t
+with a single (n_active, S, S) max-plus product, so the Python loop runs
+max(sequence length) times, not once per row or per zone.  Sequences are
+ordered longest first, so the active ones always form a prefix.  Large
+inputs are split into zone chunks decoded on a process pool.
+
+Emissions are either hard labels through an (S × K) emission matrix, or
+soft per-row log-probabilities, e.g. `soft_emissions` from k-means distances.
+"""
+
+from functools import partial
+
+import numpy as np
+from scipy.special import logsumexp
+
+from parallel import N_WORKERS, map_parallel
+
+P_SELF       = 0.9                 # probability of keeping the previous state
+CHUNK_ROWS   = 2_000_000           # rows per parallel task
+
+
+def sticky_transitions(n_states: int, p_self: float = P_SELF) -> np.ndarray:
+    """Transition matrix with ``p_self`` on the diagonal and the rest spread evenly."""
+    tm = np.full((n_states, n_states), (1 - p_self) / (n_states - 1))
+    np.fill_diagonal(tm, p_self)
+    return tm
+
+
+def _log(p) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.log(np.asarray(p, dtype=np.float64))
+
+
+def hard_emissions(labels: np.ndarray, emission: np.ndarray) -> np.ndarray:
+    """(n_rows, S) log P(observed label | state) from an (S × K) emission matrix."""
+    return _log(emission)[:, labels].T
+
+
+def soft_emissions(distances: np.ndarray, temperature: float = 1.0) -> np.ndarray:
+    """
+    (n_rows, S) log-probabilities from distances to the S cluster centres
+    (``KMeans.transform``): a softmax of -d² / temperature.
+    """
+    score = -np.square(distances) / temperature
+    return score - logsumexp(score, axis=1, keepdims=True)
+
+
+def viterbi_segments(log_emit: np.ndarray, starts: np.ndarray, log_trans: np.ndarray,
+                     log_start: np.ndarray) -> np.ndarray:
+    """
+    Most likely state path of every sequence ``log_emit[starts[i]:starts[i+1]]``
+    (the last one runs to the end).  Ties go to the lowest state.
+    """
+    n, S = log_emit.shape
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    lengths = np.diff(np.append(starts, n))
+    by_len = np.argsort(-lengths, kind="stable")      # active sequences form a prefix
+    seg_starts, seg_lens = starts[by_len], lengths[by_len]
+
+    back = np.zeros((n, S), dtype=np.int8 if S <= 127 else np.int32)
+    delta = log_start + log_emit[seg_starts]
+    for t in range(1, int(seg_lens[0])):
+        m = np.searchsorted(-seg_lens, -t, side="left")          # sequences longer than t
+        scores = delta[:m, :, None] + log_trans                  # (m, from, to)
+        best = scores.argmax(axis=1)
+        rows = seg_starts[:m] + t
+        back[rows] = best
+        delta[:m] = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0] + log_emit[rows]
+
+    path = np.empty(n, dtype=np.int64)
+    state = delta.argmax(axis=1)
+    path[seg_starts + seg_lens - 1] = state
+    for t in range(int(seg_lens[0]) - 1, 0, -1):
+        m = np.searchsorted(-seg_lens, -t, side="left")
+        rows = seg_starts[:m] + t
+        # sequences ending at t already hold their final state in `state`
+        state[:m] = back[rows, state[:m]]
+        path[rows - 1] = state[:m]
+    return path
+
+
+def _decode_chunk(chunk, log_trans, log_start):
+    log_emit, starts = chunk
+    return viterbi_segments(log_emit, starts, log_trans, log_start)
+
+
+def smooth(zone_id, time_bin, log_emit: np.ndarray, transmat: np.ndarray | None = None,
+           startprob: np.ndarray | None = None, workers: int = N_WORKERS,
+           chunk_rows: int = CHUNK_ROWS) -> np.ndarray:
+    """
+    Viterbi-smoothed state per row, one sequence per zone in time_bin order.
+    Returned in the input row order.
+
+    Args:
+        log_emit: (n_rows, S) emission log-probabilities
+            (`hard_emissions` or `soft_emissions`).
+        transmat: (S × S) transition matrix; `sticky_transitions` by default.
+        startprob: initial state distribution; uniform by default.
+    """
+    n, S = log_emit.shape
+    transmat = sticky_transitions(S) if transmat is None else transmat
+    startprob = np.full(S, 1.0 / S) if startprob is None else startprob
+
+    zone = np.asarray(zone_id)
+    order = np.lexsort((np.asarray(time_bin), zone))
+    zs = zone[order]
+    new_zone = np.ones(n, dtype=bool)
+    new_zone[1:] = zs[1:] != zs[:-1]
+    starts = np.flatnonzero(new_zone)
+    emit = log_emit[order]
+
+    # whole zones per chunk, about chunk_rows rows each
+    cuts = np.searchsorted(starts, np.arange(chunk_rows, n, chunk_rows))
+    bounds = np.unique(np.concatenate([[0], cuts, [len(starts)]]))
+    chunks = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        lo = starts[a]
+        hi = starts[b] if b < len(starts) else n
+        chunks.append((emit[lo:hi], starts[a:b] - lo))
+    decode = partial(_decode_chunk, log_trans=_log(transmat), log_start=_log(startprob))
+    paths = map_parallel(decode, chunks, workers, label="zone chunks") if len(chunks) > 1 \
+        else [decode(c) for c in chunks]
+
+    out = np.empty(n, dtype=np.int64)
+    out[order] = np.concatenate(paths) if paths else []
+    return out
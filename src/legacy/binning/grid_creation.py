@@ -1,5 +1,8 @@
 from scripts.common_imports import *
 from scripts.binning.params import SPATIAL_GRID_SIZE
+# pipeline_cache lives in src/, two levels above this module
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from pipeline_cache import StageCache
 
 # Discretize the country using the original zoning.geojson
 
@@ -14,8 +17,10 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
-if output_path_geo.exists():
-    logging.info(f"GeoJSON for {SPATIAL_GRID_SIZE}_m2 already created and stored at {output_path_geo}")
+# Rebuilt only if the zoning file's content (or the grid size) changed since the last run
+cache = StageCache("grid_creation", {"SPATIAL_GRID_SIZE": SPATIAL_GRID_SIZE})
+if cache.up_to_date(output_path_geo, [input_path]):
+    logging.info(f"GeoJSON for {SPATIAL_GRID_SIZE}_m2 is up to date at {output_path_geo}")
     sys.exit(0)
 
 slovenia = gpd.read_file(input_path) # type: ignore
@@ -46,6 +51,7 @@ grid_selected["ID"] = range(len(grid_selected))
 #Saving the file
 logging.info("Saving GeoJSON")
 grid_selected.to_file(output_path_geo, driver="GeoJSON")
+cache.record(output_path_geo, [input_path])
 
 #Saving visualization of the grid
 m= folium.Map(location=[46, 14]) # type: ignore
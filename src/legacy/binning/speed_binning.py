@@ -1,5 +1,6 @@
 from scripts.common_imports import *
 from scripts.binning.params import MAX_SPEED_KMH
+from scripts.geodesy import vincenty
 
 def analyze_speed_bins(df, zone_col='zone_id'):
     """
@@ -20,17 +21,16 @@ def add_speed_id(df):
     df['lat_shift'] = df.groupby('deviceid', observed=False)['lat'].shift()
     df['lon_shift'] = df.groupby('deviceid', observed=False)['lon'].shift()
     df['time_shift'] = df.groupby('deviceid', observed=False)['datetime'].shift()
-    
-    def compute_row_speed(row):
-        if pd.isna(row['lat_shift']):
-            return np.nan
-        d = geodesic((row['lat'], row['lon']), (row['lat_shift'], row['lon_shift'])).meters
-        t = (row['datetime'] - row['time_shift']).total_seconds()
-        if t == 0:
-            return np.nan
-        return (d / t) * 3.6  # m/s to km/h
 
-    df['speed_kmh'] = df.apply(compute_row_speed, axis=1)
+    # Ellipsoidal distance for all rows at once; NaN where there is no previous point
+    d = vincenty(df['lat'].to_numpy(), df['lon'].to_numpy(),
+                 df['lat_shift'].to_numpy(), df['lon_shift'].to_numpy())
+    t = (df['datetime'] - df['time_shift']).dt.total_seconds().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = (d / t) * 3.6  # m/s to km/h
+    speed[t == 0] = np.nan
+
+    df['speed_kmh'] = speed
     return df
 
 def filter_high_speeds(df, max_speed=MAX_SPEED_KMH):
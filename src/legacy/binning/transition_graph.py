@@ -1,17 +1,162 @@
-import networkx as nx  # type: ignore
-
-def build_graph(df):
-    """Build a transition graph between (spatial_bin, time_bin)."""
-    G = nx.DiGraph()
-
-    for device_id, group in df.groupby('deviceid', observed=False):
-        group = group.sort_values('datetime')
-        for (prev_row, next_row) in zip(group.iloc[:-1].itertuples(), group.iloc[1:].itertuples()):
-            src = (prev_row.spatial_bin_id, prev_row.time_bin)
-            dst = (next_row.spatial_bin_id, next_row.time_bin)
-            if src != dst:
-                if G.has_edge(src, dst):
-                    G[src][dst]['weight'] += 1
-                else:
-                    G.add_edge(src, dst, weight=1)
-    return G
+"""
+Transition graph between (zone_id, time_bin) nodes of a binned day.
+
+`build_graph` finds every hop of every device in one vectorized pass: rows
+are ordered by (deviceid, datetime), and consecutive rows of the same device
+whose node differs become an edge.  Edge weights are the hop counts, summed
+in a single COO → CSR conversion.  Nodes are the distinct (zone_id, time_bin)
+pairs, sorted.
+
+The analytics run on the CSR matrix directly: in/out strength, PageRank by
+power iteration, and weak/strong connected components (scipy.sparse.csgraph).
+Zone-level results collapse the time bins: the zone adjacency is Pᵀ A P with
+P the node → zone indicator.  networkx is only imported by `to_networkx`.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+NO_ZONE        = -1               # pings outside every zone (zone_index.NO_ZONE)
+PAGERANK_ALPHA = 0.85             # damping factor
+PAGERANK_TOL   = 1e-10            # L1 change between iterations
+PAGERANK_ITER  = 200
+
+
+def pagerank(adj: sparse.csr_matrix, alpha: float = PAGERANK_ALPHA,
+             tol: float = PAGERANK_TOL, max_iter: int = PAGERANK_ITER) -> np.ndarray:
+    """
+    Weighted PageRank of a square CSR adjacency matrix by power iteration.
+
+    Random jumps and the rank of dangling nodes (no out-edges) are spread
+    uniformly, as in ``networkx.pagerank``.
+    """
+    n = adj.shape[0]
+    if n == 0:
+        return np.empty(0)
+    out = np.asarray(adj.sum(axis=1)).ravel()
+    dangling = out == 0
+    inv_out = np.divide(1.0, out, out=np.zeros(n), where=~dangling)
+    adj_t = adj.T.tocsr()
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        new = alpha * (adj_t @ (rank * inv_out))
+        new += (alpha * rank[dangling].sum() + 1 - alpha) / n
+        change = np.abs(new - rank).sum()
+        rank = new
+        if change < tol:
+            break
+    return rank / rank.sum()
+
+
+class TransitionGraph:
+    def __init__(self, adj: sparse.csr_matrix, nodes: pd.DataFrame):
+        self.adj = adj                    # (n_nodes, n_nodes) hop counts
+        self.nodes = nodes                # zone_id, time_bin per node index, sorted
+
+    @property
+    def n_nodes(self) -> int:
+        return self.adj.shape[0]
+
+    @property
+    def n_edges(self) -> int:
+        return self.adj.nnz
+
+    def edges(self) -> pd.DataFrame:
+        """Weighted edge list: src/dst zone_id and time_bin, weight."""
+        coo = self.adj.tocoo()
+        zone = self.nodes["zone_id"].to_numpy()
+        tbin = self.nodes["time_bin"].to_numpy()
+        return pd.DataFrame({
+            "src_zone": zone[coo.row], "src_bin": tbin[coo.row],
+            "dst_zone": zone[coo.col], "dst_bin": tbin[coo.col],
+            "weight": coo.data,
+        })
+
+    # ───────────── node level ─────────────
+
+    def strength(self) -> pd.DataFrame:
+        """Weighted in/out degree of every node."""
+        return self.nodes.assign(
+            in_strength=np.asarray(self.adj.sum(axis=0)).ravel(),
+            out_strength=np.asarray(self.adj.sum(axis=1)).ravel(),
+        )
+
+    def node_pagerank(self, **kw) -> pd.DataFrame:
+        return self.nodes.assign(pagerank=pagerank(self.adj, **kw))
+
+    def components(self, connection: str = "weak") -> pd.DataFrame:
+        """Component label of every node ('weak' or 'strong' connectivity)."""
+        _, labels = connected_components(self.adj, directed=True, connection=connection)
+        return self.nodes.assign(component=labels)
+
+    # ───────────── zone level ─────────────
+
+    def zone_adjacency(self, self_loops: bool = False) -> tuple[sparse.csr_matrix, np.ndarray]:
+        """
+        Zone × zone hop counts over all time bins, and the sorted zone_ids.
+        Self-loops (staying in a zone across time bins) are dropped by default.
+        """
+        zones, node_zone = np.unique(self.nodes["zone_id"].to_numpy(), return_inverse=True)
+        p = sparse.csr_matrix((np.ones(self.n_nodes, dtype=self.adj.dtype),
+                               (np.arange(self.n_nodes), node_zone)),
+                              shape=(self.n_nodes, len(zones)))
+        zadj = (p.T @ self.adj @ p).tocsr()
+        if not self_loops:
+            zadj.setdiag(0)
+            zadj.eliminate_zeros()
+        return zadj, zones
+
+    def zone_centrality(self, self_loops: bool = False, **kw) -> pd.DataFrame:
+        """In/out strength, PageRank and weak component of every zone."""
+        zadj, zones = self.zone_adjacency(self_loops)
+        _, labels = connected_components(zadj, directed=True, connection="weak")
+        return pd.DataFrame({
+            "zone_id": zones,
+            "in_strength": np.asarray(zadj.sum(axis=0)).ravel(),
+            "out_strength": np.asarray(zadj.sum(axis=1)).ravel(),
+            "pagerank": pagerank(zadj, **kw),
+            "component": labels,
+        })
+
+    # ───────────── export ─────────────
+
+    def to_networkx(self):
+        """networkx.DiGraph with (zone_id, time_bin) node tuples and 'weight' edges."""
+        import networkx as nx  # type: ignore
+
+        G = nx.DiGraph()
+        e = self.edges()
+        G.add_weighted_edges_from(zip(zip(e["src_zone"].tolist(), e["src_bin"].tolist()),
+                                      zip(e["dst_zone"].tolist(), e["dst_bin"].tolist()),
+                                      e["weight"].tolist()))
+        return G
+
+
+def build_graph(df, zone_col="zone_id"):
+    """
+    Build the transition graph between (zone, time_bin) nodes of ``df``
+    (deviceid, datetime, zone_col, time_bin).  Rows without a zone are dropped.
+    """
+    zone = df[zone_col].to_numpy()
+    keep = ~pd.isna(zone)
+    keep[keep] = zone[keep] != NO_ZONE
+    dev, _ = pd.factorize(df["deviceid"].to_numpy()[keep])
+    t = df["datetime"].to_numpy()[keep].astype("datetime64[ns]").astype(np.int64)
+    zone = zone[keep].astype(np.int64)
+    tbin = df["time_bin"].to_numpy()[keep].astype(np.int64)
+
+    order = np.lexsort((t, dev))
+    dev, zone, tbin = dev[order], zone[order], tbin[order]
+
+    n_bins = int(tbin.max()) + 1 if len(tbin) else 1
+    keys, node = np.unique(zone * n_bins + tbin, return_inverse=True)
+    nodes = pd.DataFrame({"zone_id": keys // n_bins, "time_bin": keys % n_bins})
+
+    hop = (dev[1:] == dev[:-1]) & (node[1:] != node[:-1])
+    src, dst = node[:-1][hop], node[1:][hop]
+    adj = sparse.coo_matrix((np.ones(len(src), dtype=np.int64), (src, dst)),
+                            shape=(len(keys), len(keys))).tocsr()
+    adj.sum_duplicates()
+    return TransitionGraph(adj, nodes)
@@ -1,10 +1,17 @@
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 import folium
 from sklearn.cluster import DBSCAN
 from datetime import datetime
 import math
 import time
+import sys
+from pathlib import Path
+
+# trace_index is a top-level pipeline module in src/, the parent of this folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from trace_index import TraceIndex
 
 
 # -----------------------------
@@ -29,24 +36,20 @@ def haversine_vectorized(lat1, lon1, lat2, lon2):
 # 1. Data Loading and Filtering
 # -----------------------------
 start_time = time.time()
-print("Loading dataset...")
-df = pd.read_parquet("training_set/20230327.parquet")
-
-# OPTIONAL: Reduce the dataset size for faster processing during experimentation.
-# Uncomment the following line to sample a subset of data:
-# df = df.head(10000)  # Process only the first 10,000 rows
-
-print("Dataset loaded. Total rows:", len(df))
+data_path = "training_set/20230327.parquet"
 
 # Extract the first device id and corresponding date from the dataset
-first_device_id = df.iloc[0]['deviceid']
-date_to_plot = df.iloc[0]['date']
+first_row = pq.ParquetFile(data_path).read_row_group(0, columns=["deviceid", "date"]).slice(0, 1)
+first_device_id = first_row.column("deviceid")[0].as_py()
+date_to_plot = first_row.column("date")[0].as_py()
 
 print(f"Selected device ID: {first_device_id}")
 print(f"Selected date: {date_to_plot}")
 
-# Filter the data for the selected device and date
-df_sub = df[(df['deviceid'] == first_device_id) & (df['date'] == date_to_plot)].copy()
+# Read only the selected device's rows (trace index), then filter the date
+print("Loading device trace...")
+df_sub = TraceIndex.load_or_build(data_path).read(first_device_id)
+df_sub = df_sub[df_sub['date'] == date_to_plot].copy()
 if df_sub.empty:
     raise ValueError("No data found for the specified device and date. Please check your filter values.")
 
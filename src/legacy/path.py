@@ -1,18 +1,25 @@
 import pandas as pd
+import pyarrow.parquet as pq
 import folium
+import sys
+from pathlib import Path
 
-# Load the dataset from the Parquet file
-df = pd.read_parquet("training_set/20230327.parquet")
+# trace_index is a top-level pipeline module in src/, the parent of this folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from trace_index import TraceIndex
 
-# Print the first few rows to see the full device IDs
-print(df.head())
+# Only the first row and the selected device's row groups are read from the file
+data_path = "training_set/20230327.parquet"
+first_row = pq.ParquetFile(data_path).read_row_group(0, columns=["deviceid", "date"]).slice(0, 1)
+print(first_row.to_pandas())
 
-# Extract the first device ID and corresponding date from the DataFrame
-first_device_id = df.iloc[0]['deviceid']
-date_to_plot = df.iloc[0]['date']
+# Extract the first device ID and corresponding date from the file
+first_device_id = first_row.column("deviceid")[0].as_py()
+date_to_plot = first_row.column("date")[0].as_py()
 
-# Filter the data for the first device and its date
-df_sub = df[(df['deviceid'] == first_device_id) & (df['date'] == date_to_plot)]
+# Load the trace of the first device and filter its date
+df_sub = TraceIndex.load_or_build(data_path).read(first_device_id)
+df_sub = df_sub[df_sub['date'] == date_to_plot]
 
 # Check if the filtered DataFrame is empty
 if df_sub.empty:
@@ -1,99 +1,123 @@
 from scripts.common_imports import *
+from scripts.geodesy import haversine, vincenty
 
 # ==================== Denoising Methods ====================
+#
+# Each method works on flat arrays sorted by (device, datetime) and returns a
+# keep-mask; `device` holds one code per row, so one call can cover a single
+# device or a whole partition.
+
+def _seconds(dt_series):
+    return dt_series.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+
+
+def _same_device_neighbours(device):
+    """(has_prev, has_next) per row: neighbour exists and belongs to the same device."""
+    n = len(device)
+    same = device[1:] == device[:-1]
+    has_prev = np.zeros(n, dtype=bool)
+    has_next = np.zeros(n, dtype=bool)
+    has_prev[1:] = same
+    has_next[:-1] = same
+    return has_prev, has_next
+
+
+def _window_hop_median(device, speeds, valid, half_window):
+    """
+    Median hop speed around every point.  Point i's window holds hops
+    i-half_window .. i+half_window-1 (hop j joins points j and j+1) that lie
+    inside i's device and are `valid`.  Like np.median, a NaN speed in the
+    window gives NaN; a window without hops gives NaN with count 0.
+    """
+    n = len(device)
+    if n < 2 or half_window == 0:
+        return np.full(n, np.nan), np.zeros(n, dtype=np.int64)
+
+    i = np.arange(n)[:, None]
+    j = i + np.arange(-half_window, half_window)
+    jc = np.clip(j, 0, n - 2)
+    inside = (j >= 0) & (j <= n - 2) & (device[jc] == device[i]) & (device[jc + 1] == device[i])
+    ok = inside & valid[jc]
+
+    # absent slots are +inf so they sort after every real speed
+    windows = np.where(ok, speeds[jc], np.inf)
+    windows.sort(axis=1)
+    count = ok.sum(axis=1)
+    r = np.arange(n)
+    median = (windows[r, np.maximum(count - 1, 0) // 2] + windows[r, count // 2]) / 2
+    median[count == 0] = np.nan
+    median[np.isnan(windows).any(axis=1)] = np.nan
+    return median, count
+
+
+def _zhang_keep(device, lat, lon, t, speed_thres, angle_thres, time_thres_s):
+    has_prev, has_next = _same_device_neighbours(device)
+    n = len(device)
+    prev = np.maximum(np.arange(n) - 1, 0)
+    nxt = np.minimum(np.arange(n) + 1, n - 1)
+
+    dt = t - t[prev]
+    dist = vincenty(lat[prev], lon[prev], lat, lon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(dt > 0, dist / dt, 0)
+
+    # planar angle prev <- point -> next in degree space
+    ax, ay = lat[prev] - lat, lon[prev] - lon
+    bx, by = lat[nxt] - lat, lon[nxt] - lon
+    na = np.sqrt(ax * ax + ay * ay)
+    nb = np.sqrt(bx * bx + by * by)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos = np.clip((ax * bx + ay * by) / (na * nb), -1.0, 1.0)
+    angle = np.where((na == 0) | (nb == 0), 0, np.degrees(np.arccos(cos)))
+
+    keep = (speed < speed_thres) & ((angle > angle_thres) | (dt > time_thres_s))
+    return keep & has_prev & has_next
+
+
+def _hop_speeds(lat, lon, t, distance):
+    dists = distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    dts = np.diff(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.where(dts > 0, dists / dts, 0)
+    return speeds, dts
+
+
+def _sliding_keep(device, lat, lon, t, window_size, speed_thres):
+    """Median of the hop speeds with dt > 0 in the window (0 if none) below speed_thres."""
+    speeds, dts = _hop_speeds(lat, lon, t, vincenty)
+    median, count = _window_hop_median(device, speeds, dts > 0, window_size // 2)
+    median = np.where(count == 0, 0, median)
+    windowed = len(device) >= 2 and window_size // 2 > 0
+    return (median < speed_thres) & windowed
+
+
+def _sliding_vectorized_keep(device, lat, lon, t, window_size, speed_thres):
+    """Median of all hop speeds in the window (0 for dt <= 0) below speed_thres."""
+    speeds, dts = _hop_speeds(lat, lon, t, haversine)
+    median, _ = _window_hop_median(device, speeds, np.ones(len(dts), dtype=bool), window_size // 2)
+    return median < speed_thres
 
-def compute_angle(p1, p2, p3):
-    a = np.array([p1['lat'] - p2['lat'], p1['lon'] - p2['lon']])
-    b = np.array([p3['lat'] - p2['lat'], p3['lon'] - p2['lon']])
-    if np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
-        return 0
-    return np.degrees(np.arccos(np.clip(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)), -1.0, 1.0)))
 
 def zhang_denoise_device(df, speed_thres=50, angle_thres=30, time_thres=timedelta(seconds=10)):
     "speed_threshold is in m/s, 50m/s = 180 km/h"
     if "datetime" not in df.columns:
         raise ValueError(f"Missing 'datetime' column in input data! Columns found: {df.columns.tolist()}")
     df = df.sort_values('datetime').reset_index(drop=True)
-    filtered = []
-    for i in range(1, len(df) - 1):
-        p1, p2, p3 = df.iloc[i-1], df.iloc[i], df.iloc[i+1]
-        dt = (p2['datetime'] - p1['datetime']).total_seconds()
-        dist = geodesic((p1['lat'], p1['lon']), (p2['lat'], p2['lon'])).meters
-        speed = dist / dt if dt > 0 else 0
-        angle = compute_angle(p1, p2, p3)
-        if speed < speed_thres and (angle > angle_thres or dt > time_thres.total_seconds()):
-            filtered.append(p2)
-    return pd.DataFrame(filtered)
+    keep = _zhang_keep(np.zeros(len(df), dtype=np.int64), df['lat'].values, df['lon'].values,
+                       _seconds(df['datetime']), speed_thres, angle_thres, time_thres.total_seconds())
+    return df[keep]
 
 def sliding_window_denoise_device(df, window_size=5, speed_thres=50):
     df = df.sort_values('datetime').reset_index(drop=True)
-    half_window = window_size // 2
-    filtered_indices = []
-
-    for i in range(len(df)):
-        window_start = max(0, i - half_window)
-        window_end = min(len(df), i + half_window + 1)
-        window = df.iloc[window_start:window_end]
-
-        if len(window) < 2:
-            continue  # Not enough points to compute speed
-
-        speeds = []
-        for j in range(1, len(window)):
-            prev, curr = window.iloc[j-1], window.iloc[j]
-            dt = (curr['datetime'] - prev['datetime']).total_seconds()
-            dist = geodesic((prev['lat'], prev['lon']), (curr['lat'], curr['lon'])).meters
-            if dt > 0:
-                speeds.append(dist / dt)
-
-        median_speed = np.median(speeds) if speeds else 0
-        if median_speed < speed_thres:
-            filtered_indices.append(i)
-
-    return df.iloc[filtered_indices].reset_index(drop=True)
-
-def haversine_np(lat1, lon1, lat2, lon2):
-    R = 6371000  # Earth radius in meters
-    lat1 = np.radians(lat1)
-    lat2 = np.radians(lat2)
-    dlat = lat2 - lat1
-    dlon = np.radians(lon2 - lon1)
-    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-    return 2 * R * np.arcsin(np.sqrt(a))
+    keep = _sliding_keep(np.zeros(len(df), dtype=np.int64), df['lat'].values, df['lon'].values,
+                         _seconds(df['datetime']), window_size, speed_thres)
+    return df[keep].reset_index(drop=True)
 
 def sliding_window_denoise_device_vectorized(df, window_size=5, speed_thres=50):
     df = df.sort_values('datetime').reset_index(drop=True)
-    half_window = window_size // 2
-    lat = df['lat'].values
-    lon = df['lon'].values
     time = df['datetime'].values.astype('datetime64[s]').astype(np.int64)
-
-    n = len(df)
-    keep = np.zeros(n, dtype=bool)
-
-    for i in range(n):
-        start = max(0, i - half_window)
-        end = min(n, i + half_window + 1)
-
-        lat_window = lat[start:end]
-        lon_window = lon[start:end]
-        time_window = time[start:end]
-
-        if len(lat_window) < 2:
-            continue
-
-        # Compute distances between consecutive points
-        dists = haversine_np(lat_window[:-1], lon_window[:-1], lat_window[1:], lon_window[1:])
-        dts = np.diff(time_window)
-
-        with np.errstate(divide='ignore', invalid='ignore'):
-            speeds = np.where(dts > 0, dists / dts, 0)
-
-        median_speed = np.median(speeds)
-
-        if median_speed < speed_thres:
-            keep[i] = True
-
+    keep = _sliding_vectorized_keep(np.zeros(len(df), dtype=np.int64), df['lat'].values,
+                                    df['lon'].values, time, window_size, speed_thres)
     return df[keep].reset_index(drop=True)
 
 
@@ -101,17 +125,22 @@ def sliding_window_denoise_device_vectorized(df, window_size=5, speed_thres=50):
 # ==================== Dask Processing ====================
 
 def denoise_partition(df_partition, method="sliding"):
-    results = []
-    for device_id, group in df_partition.groupby('deviceid', observed=False):
-        if method == "zhang":
-            cleaned = zhang_denoise_device(group)
-        elif method == "sliding":
-            cleaned = sliding_window_denoise_device_vectorized(group)
-        else:
-            raise ValueError("Unsupported method: choose 'zhang' or 'sliding'")
-        if not cleaned.empty:
-            results.append(cleaned)
-    if results:
-        return pd.concat(results)
+    """Denoise every device of the partition in one pass over its arrays."""
+    if method not in ("zhang", "sliding"):
+        raise ValueError("Unsupported method: choose 'zhang' or 'sliding'")
+
+    df = df_partition.sort_values(['deviceid', 'datetime'], kind='stable').reset_index(drop=True)
+    device, _ = pd.factorize(df['deviceid'])
+    lat, lon = df['lat'].values, df['lon'].values
+    if method == "zhang":
+        keep = _zhang_keep(device, lat, lon, _seconds(df['datetime']),
+                           50, 30, timedelta(seconds=10).total_seconds())
+    else:
+        time = df['datetime'].values.astype('datetime64[s]').astype(np.int64)
+        keep = _sliding_vectorized_keep(device, lat, lon, time, 5, 50)
+    keep &= device >= 0                                   # groupby drops missing deviceids
+
+    if keep.any():
+        return df[keep]
     else:
-        return pd.DataFrame(columns=df_partition.columns)
\ No newline at end of file
+        return pd.DataFrame(columns=df_partition.columns)
@@ -24,7 +24,10 @@ def main():
         sys.exit(1)
 
     logging.info(f"Loading {input_path}")
-    ddf = dd.read_parquet(input_path, columns=["deviceid", "datetime", "lon", "lat"])
+    # One partition per part file: the splitter writes many row groups, and a
+    # device must not be spread over several map_partitions calls
+    ddf = dd.read_parquet(input_path, columns=["deviceid", "datetime", "lon", "lat"],
+                          split_row_groups=False)
 
     logging.info(f"Applying denoise to part {part_id} with map_partitions")
     cleaned_ddf = ddf.map_partitions(denoise_partition)
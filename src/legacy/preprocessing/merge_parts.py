@@ -1,6 +1,85 @@
 from common_imports import *
+import pyarrow.compute as pc # type: ignore
+import pyarrow.parquet as pq # type: ignore
 
-def merge_day(day_str):
+SORT_KEYS = [("deviceid", "ascending"), ("datetime", "ascending")]
+BATCH_ROWS = 1_000_000  # rows per batch read from each part in the sorted merge
+
+def _append_row_groups(parts, writer, schema):
+    """Copy every row group of every part into the writer, one row group in memory."""
+    rows = 0
+    for p in parts:
+        pf = pq.ParquetFile(p)
+        for i in range(pf.num_row_groups):
+            table = pf.read_row_group(i)
+            writer.write_table(table if table.schema.equals(schema) else table.cast(schema))
+            rows += table.num_rows
+    return rows
+
+def _first_key(table):
+    return (table.column("deviceid")[0].as_py(), table.column("datetime")[0].as_py())
+
+def _last_key(table):
+    return (table.column("deviceid")[-1].as_py(), table.column("datetime")[-1].as_py())
+
+def _at_most(table, key):
+    """Mask of rows whose (deviceid, datetime) is <= key."""
+    dev, dt = table.column("deviceid"), table.column("datetime")
+    return pc.or_(pc.less(dev, key[0]),
+                  pc.and_(pc.equal(dev, key[0]), pc.less_equal(dt, pa.scalar(key[1], dt.type))))
+
+def _kway_merge(parts, writer, schema, batch_rows):
+    """
+    Merge parts that are each sorted by (deviceid, datetime) into one sorted
+    output.  One batch per part is buffered: every round writes all buffered
+    rows up to the smallest last key among the buffers (no part can still
+    hold anything smaller) and refills the buffers that ran empty.
+    """
+    streams, buffers, last = {}, {}, {}
+
+    def refill(idx):
+        for batch in streams[idx]:
+            if batch.num_rows:
+                table = pa.Table.from_batches([batch])
+                table = table if table.schema.equals(schema) else table.cast(schema)
+                if idx in last and _first_key(table) < last[idx]:
+                    raise ValueError(f"{parts[idx]} is not sorted by (deviceid, datetime)")
+                buffers[idx], last[idx] = table, _last_key(table)
+                return
+        del streams[idx]
+        buffers.pop(idx, None)
+
+    for idx, p in enumerate(parts):
+        streams[idx] = iter(pq.ParquetFile(p).iter_batches(batch_size=batch_rows))
+        refill(idx)
+
+    rows = 0
+    while buffers:
+        bound = min(_last_key(t) for t in buffers.values())
+        taken = []
+        for idx in list(buffers):
+            mask = _at_most(buffers[idx], bound)
+            taken.append(buffers[idx].filter(mask))
+            rest = buffers[idx].filter(pc.invert(mask))
+            if rest.num_rows:
+                buffers[idx] = rest
+            else:
+                refill(idx)
+        merged = pa.concat_tables(taken).sort_by(SORT_KEYS)
+        writer.write_table(merged)
+        rows += merged.num_rows
+    return rows
+
+def merge_day(day_str, sort=False, batch_rows=BATCH_ROWS):
+    """
+    Merge denoised_output/<day>/denoised_part_*.parquet into
+    denoised_output/<day>_full.parquet through Arrow, without pandas.
+
+    By default row groups are appended as they are (peak memory: one row
+    group).  With ``sort=True`` the parts, each sorted by (deviceid,
+    datetime), are k-way merged into one sorted file (peak memory: one batch
+    per part).
+    """
     input_dir = Path(f"denoised_output/{day_str}")
     parts = sorted(input_dir.glob("denoised_part_*.parquet"))
 
@@ -8,19 +87,22 @@ def merge_day(day_str):
         print(f"No parts found for {day_str}. Skipping.")
         return
 
-    dfs = []
-    for p in parts:
-        dfs.append(pd.read_parquet(p))
-    
-    merged = pd.concat(dfs, ignore_index=True)
+    schema = pq.read_schema(parts[0]).remove_metadata()
     output_file = Path(f"denoised_output/{day_str}_full.parquet")
-    merged.to_parquet(output_file, index=False)
-    print(f"Merged {len(parts)} parts into {output_file}")
+    tmp_file = output_file.with_suffix(".parquet.tmp")
+    with pq.ParquetWriter(tmp_file, schema) as writer:
+        if sort:
+            rows = _kway_merge(parts, writer, schema, batch_rows)
+        else:
+            rows = _append_row_groups(parts, writer, schema)
+    os.replace(tmp_file, output_file)
+    print(f"Merged {len(parts)} parts ({rows:,} rows) into {output_file}")
 
 def main():
     days = ["20230327", "20230328", "20230329", "20230330", "20230331", "20230401", "20230402"]
-    for day in days:
-        merge_day(day)
+    sort = "--sort" in sys.argv
+    with multiprocessing.Pool(min(len(days), os.cpu_count() or 1)) as pool:
+        pool.starmap(merge_day, [(day, sort) for day in days])
 
 if __name__ == "__main__":
     main()
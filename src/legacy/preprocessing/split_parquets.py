@@ -1,50 +1,90 @@
 from scripts.common_imports import *
+import pyarrow.parquet as pq # type: ignore
 
-def split_parquet(input_file: Path, output_folder: Path, n_splits: int = 32):
+# Splits done to the data, consistent with TOTAL_PARTS in denoise_batch_split.sh
+N_PARTS = 32
+BATCH_ROWS = 2_000_000  # rows read per row-group batch; bounds memory
+
+PART_SCHEMA = pa.schema([
+    ("deviceid", pa.string()),
+    ("lon", pa.float64()),
+    ("lat", pa.float64()),
+    ("datetime", pa.timestamp("ns")),
+])
+
+def device_parts(deviceid: pd.Series, n_parts: int = N_PARTS) -> np.ndarray:
+    """
+    Stable part number per row: the same deviceid lands in the same part in
+    every batch, on every run (same hash as parallel.device_shards).
+    Categorical ids are hashed by value, not by code.
+    """
+    hashes = pd.util.hash_pandas_object(deviceid, index=False).to_numpy()
+    return (hashes % np.uint64(n_parts)).astype(np.int64)
+
+def split_parquet(input_file: Path, output_folder: Path, n_splits: int = N_PARTS,
+                  batch_rows: int = BATCH_ROWS):
+    """
+    Stream ``input_file`` batch by batch and route every row to one of
+    ``n_splits`` part files by device hash, so each device's rows end up in
+    exactly one part.  Parts are written to ``.tmp`` files and renamed once
+    complete; all parts are created, even empty ones, so every SLURM array
+    task finds its input.  Returns the row count of every part.
+    """
     if not input_file.exists():
         logging.error(f"Input file {input_file} does not exist.")
         return
     day_str = input_file.stem
-    formatted_date = f"{day_str[:4]}-{day_str[4:6]}-{day_str[6:]}"
-    
-    logging.info("Reading .Parquet file")
-    df = pd.read_parquet(input_file, columns=["deviceid", "time", "lon", "lat"])
-    
-    logging.info("Merging date and time into datetime")
-    df["datetime"] = pd.to_datetime(
-        formatted_date + " " + df["time"].astype(str),
-        format="%Y-%m-%d %H:%M:%S"
-    )
-    
-    logging.info("Dropping 'time' column")
-    df = df.drop(columns=["time"])
-    parts = split_by_device(df, n_parts=32)
+    day = pd.Timestamp(f"{day_str[:4]}-{day_str[4:6]}-{day_str[6:]}")
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    for idx, part in enumerate(parts):
-        part_path = output_folder / f"part_{idx}.parquet"
-        part.to_parquet(part_path, index=False)
-        logging.info(f"Saved split part {idx} to {part_path}")
-        
-def split_by_device(df, n_parts=32):
-    # Sort properly    
-    df = df.sort_values(["deviceid", "datetime"])
+    part_paths = [output_folder / f"part_{idx}.parquet" for idx in range(n_splits)]
+    tmp_paths = [p.with_suffix(".parquet.tmp") for p in part_paths]
+    writers = [pq.ParquetWriter(tmp, PART_SCHEMA) for tmp in tmp_paths]
+    sizes = np.zeros(n_splits, dtype=np.int64)
+    devices = np.zeros(n_splits, dtype=np.int64)
 
-    # Group by device
-    groups = list(df.groupby("deviceid", observed=False))
+    logging.info(f"Streaming {input_file} into {n_splits} parts")
+    try:
+        source = pq.ParquetFile(input_file)
+        for batch in source.iter_batches(batch_size=batch_rows,
+                                         columns=["deviceid", "time", "lon", "lat"]):
+            df = batch.to_pandas()
+            # Merge date and time into datetime
+            df["datetime"] = day + pd.to_timedelta(df["time"].astype(str))
+            df = df.drop(columns=["time"])
+            if isinstance(df["deviceid"].dtype, pd.CategoricalDtype):
+                df["deviceid"] = df["deviceid"].astype(object)
 
-    partitions = [[] for _ in range(n_parts)]
-    sizes = [0] * n_parts  # Track partition sizes
+            part = device_parts(df["deviceid"], n_splits)
+            order = np.argsort(part, kind="stable")
+            bounds = np.searchsorted(part[order], np.arange(n_splits + 1))
+            for idx in np.flatnonzero(np.diff(bounds)):
+                chunk = df.take(order[bounds[idx]:bounds[idx + 1]])
+                writers[idx].write_table(
+                    pa.Table.from_pandas(chunk, schema=PART_SCHEMA, preserve_index=False))
+                sizes[idx] += len(chunk)
+    finally:
+        for writer in writers:
+            writer.close()
 
-    for device_id, group in groups:
-        # Assign device group to the partition with currently least rows
-        idx = sizes.index(min(sizes))
-        partitions[idx].append(group)
-        sizes[idx] += len(group)
+    for tmp, path in zip(tmp_paths, part_paths):
+        os.replace(tmp, path)
+    for idx, path in enumerate(part_paths):
+        if sizes[idx]:
+            devices[idx] = len(pq.read_table(path, columns=["deviceid"]).column(0).unique())
+    report_balance(sizes, devices)
+    return sizes
 
-    # Combine lists
-    final_parts = [pd.concat(part) for part in partitions]
-    return final_parts
+def report_balance(sizes: np.ndarray, devices: np.ndarray):
+    """Log rows/devices per part and the imbalance (largest part / mean part)."""
+    total = int(sizes.sum())
+    for idx, (rows, devs) in enumerate(zip(sizes, devices)):
+        logging.info(f"part_{idx}: {rows:,} rows, {devs:,} devices")
+    if total:
+        mean = total / len(sizes)
+        logging.info(f"Balance: {total:,} rows, {int(devices.sum()):,} devices in {len(sizes)} parts; "
+                     f"min {sizes.min():,}, max {sizes.max():,} rows, "
+                     f"max/mean {sizes.max() / mean:.3f}")
 
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -61,7 +101,7 @@ def main():
         day_str = file.stem
         logging.info(f"Splitting day {day_str}")
         output_folder = output_root / day_str
-        split_parquet(file, output_folder, n_splits=32)
+        split_parquet(file, output_folder, n_splits=N_PARTS)
     logging.info("Finished splitting all days.")
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 from scripts.common_imports import *
+# dataset_stats (and its parallel helper) live in src/, two levels above this module
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from dataset_stats import dataset_stats
 
 def compute_stats(df, label):
     stats = {}
@@ -33,94 +36,23 @@ def compare_stats(original, cleaned):
 
     return report
 
-def all_stats():
+def all_stats(hll_precision=None):
     # Folder with all daily parquet files
     data_dir = Path("data")
     files = sorted(data_dir.glob("2023*.parquet"))
 
-    daily_stats = []
-
-    for f in files:
-        df = pd.read_parquet(f, columns=["deviceid", "date", "time", "lon", "lat"], engine="fastparquet")
-        date_str = f.stem  # '20230327'
-        df["datetime"] = pd.to_datetime(date_str + " " + df["time"].astype("string"), format="%Y%m%d %H:%M:%S")
-        df = df.dropna(subset=["datetime", "lat", "lon", "deviceid"])
-
-        day = df["datetime"].dt.date.iloc[0]
-        unique_devices = df["deviceid"].nunique()
-        total_points = len(df)
-        avg_points_per_device = total_points / unique_devices
-        duration = (df["datetime"].max() - df["datetime"].min()).total_seconds() / 3600
-
-        # Points per device stats
-        pts_per_device = df.groupby("deviceid", observed=False).size()
-        median_points = pts_per_device.median()
-        std_points = pts_per_device.std()
-
-        # Sampling rate stats
-        df = df.sort_values(["deviceid", "datetime"])
-        df["delta"] = df.groupby("deviceid", observed=False)["datetime"].diff().dt.total_seconds()
-        mean_delta = df["delta"].mean()
-        median_delta = df["delta"].median()
-        std_delta = df["delta"].std()
-
-        # Spatial coverage
-        lat_min, lat_max = df["lat"].min(), df["lat"].max()
-        lon_min, lon_max = df["lon"].min(), df["lon"].max()
-        area_km2 = (lat_max - lat_min) * (lon_max - lon_min) * 111 * 111
-
-        # Day vs Night
-        df["hour"] = df["datetime"].dt.hour
-        day_ratio = (df["hour"].between(6, 20)).mean() * 100
-        night_ratio = 100 - day_ratio
-
-        # Null counts
-        nulls = df[["deviceid", "lat", "lon", "datetime"]].isnull().sum().to_dict()
-
-        daily_stats.append({
-            "date": str(day),
-            "total_points": total_points,
-            "unique_devices": unique_devices,
-            "avg_points_per_device": round(avg_points_per_device, 2),
-            "median_points_per_device": median_points,
-            "std_points_per_device": std_points,
-            "mean_sampling_interval_s": round(mean_delta, 2),
-            "median_sampling_interval_s": round(median_delta, 2),
-            "std_sampling_interval_s": round(std_delta, 2),
-            "hours_covered": round(duration, 2),
-            "day_ratio_%": round(day_ratio, 2),
-            "night_ratio_%": round(night_ratio, 2),
-            "lat_min": lat_min,
-            "lat_max": lat_max,
-            "lon_min": lon_min,
-            "lon_max": lon_max,
-            "area_est_km2": round(area_km2, 2),
-            "null_counts": nulls
-        })
-
-    # Weekly summary
-    stats_df = pd.DataFrame(daily_stats)
+    # One parallel pass per day; the weekly row is merged_summary of the per-day
+    # states, so devices seen on several days are counted once
+    stats_df, weekly = dataset_stats(files, hll_precision=hll_precision)
+    stats_df = stats_df.drop(columns=["file"])
     stats_df.to_csv("data/summary_each_day.csv")
 
-    stats_df["date"] = pd.to_datetime(stats_df["date"])
-
-    weekly = {
-        "date_range": f"{stats_df['date'].min().date()} → {stats_df['date'].max().date()}",
-        "total_points": stats_df["total_points"].sum(),
-        "unique_devices_total": stats_df["unique_devices"].sum(),
-        "avg_points_per_day": round(stats_df["total_points"].mean(), 2),
-        "avg_devices_per_day": round(stats_df["unique_devices"].mean(), 2),
-        "total_hours_covered": round(stats_df["hours_covered"].sum(), 2),
-        "avg_daytime_ratio_%": round(stats_df["day_ratio_%"].mean(), 2),
-        "avg_area_km2": round(stats_df["area_est_km2"].mean(), 2)
-    }
-
     week_df = pd.DataFrame([weekly])
     week_df.to_csv("data/summary_week.csv")
 
     # Display
     print("📅 Daily Stats:")
-    pprint(daily_stats)
+    pprint(stats_df.to_dict("records"))
     print("\n📊 Weekly Summary:")
     pprint(weekly)
 
@@ -1,11 +1,16 @@
 import logging
+import sys
+from pathlib import Path
 import dask.dataframe as dd
 import pandas as pd
 import numpy as np
-from scipy.spatial import cKDTree
 from sklearn.mixture import GaussianMixture
 import folium
 
+# tower_index is a top-level pipeline module in src/, the parent of this package
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from tower_index import TowerIndex
+
 # -----------------------------
 # CONFIGURE LOGGING
 # -----------------------------
@@ -48,14 +53,13 @@ def main():
     zdf['speed_m_s'] = zdf['distance'] / zdf['time_diff']
     zone_logger.info("Computed speed_m_s for each ping")
 
-    # load towers and compute distances
-    towers = pd.read_csv("cell_towers.csv")  # columns: lat, lon
-    tree = cKDTree(towers[['lat','lon']])
-    dists, idxs = tree.query(zdf[['lat','lon']], k=3)
+    # load towers and compute distances (meters, via the cached unit-sphere index)
+    towers = TowerIndex.load_or_build("cell_towers.csv", lat_col="lat", lon_col="lon")
+    dists, idxs = towers.nearest(zdf['lat'].to_numpy(), zdf['lon'].to_numpy(), k=3)
     zdf[['d1','d2','d3']] = dists
     zone_logger.info("Computed distances to 3 nearest towers")
 
-    # filter outliers
+    # filter outliers (no tower within 3 km)
     zf = zdf[zdf['d1'] < 3000]
     zone_logger.info(f"Filtered outliers, remaining {len(zf)} rows")
 
@@ -81,9 +85,9 @@ def main():
             radius=3, color=color, fill=True, fill_color=color
         ).add_to(m_z)
 
-    for _, t in towers.iterrows():
+    for t_lat, t_lon in towers.lat_lon:
         folium.Marker(
-            location=(t['lat'], t['lon']),
+            location=(t_lat, t_lon),
             icon=folium.Icon(color='black', icon='tower'),
             popup="Tower"
         ).add_to(m_z)
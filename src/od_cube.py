@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Multi-day origin–destination cube.
+
+Counts are kept sparse, indexed by (day, time_bin, FROM, TO) with integer
+zone ids: one parquet per day, ``<cube>/day=<YYYYMMDD>.parquet``, sorted by
+(time_bin, FROM, TO).  Appending a day writes only that day's file; days
+whose transitions file is unchanged are skipped (pipeline_cache manifest).
+
+Rollups (day, week, weekday, weekend, hour) and top-k destinations per
+origin are grouped sums and sorts over the sparse rows, never a dense
+zones × zones table.
+
+Usage:
+    python od_cube.py                            # append data_transitions/*.parquet
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy import sparse
+
+from pipeline_cache import StageCache
+from transition_store import TransitionTensor
+
+TRANSITIONS_DIR  = Path("data_transitions")
+CUBE_DIR         = Path("data_od_cube")
+TIME_BIN_MINUTES = 60                    # as in Binning_sequential
+
+ROLLUPS = ("day", "week", "weekday", "weekend", "hour")
+
+logger = logging.getLogger(__name__)
+
+
+def _day_frame(fp: Path) -> pd.DataFrame:
+    """A transitions file as sparse int rows (TO is stored as float upstream)."""
+    df = pd.read_parquet(fp, columns=["time_bin", "FROM", "TO", "count"])
+    df = df.dropna(subset=["FROM", "TO"])
+    df = pd.DataFrame({
+        "time_bin": df["time_bin"].to_numpy(np.int16),
+        "FROM": df["FROM"].to_numpy().astype(np.int32),
+        "TO": df["TO"].to_numpy().astype(np.int32),
+        "count": df["count"].to_numpy(np.int64),
+    })
+    df = df.groupby(["time_bin", "FROM", "TO"], sort=True, as_index=False)["count"].sum()
+    return df
+
+
+class ODCube:
+    def __init__(self, root: Path = CUBE_DIR, bin_minutes: int = TIME_BIN_MINUTES):
+        self.root = Path(root)
+        self.bin_minutes = bin_minutes
+
+    def day_path(self, day: str) -> Path:
+        return self.root / f"day={day}.parquet"
+
+    def days(self) -> list[str]:
+        return sorted(p.stem.split("=", 1)[1] for p in self.root.glob("day=*.parquet"))
+
+    # ───────────── building ─────────────
+
+    def append(self, transition_files, force: bool = False) -> list[str]:
+        """Add (or refresh) the days of ``transition_files``; returns the days written."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        cache = StageCache("od_cube", {}, force=force)
+        todo = cache.pending([(self.day_path(fp.stem), [fp]) for fp in transition_files],
+                             label="days")
+        for out, (fp,) in todo:
+            df = _day_frame(fp)
+            df.to_parquet(out, index=False)
+            cache.record(out, [fp])
+            logger.info("Cube day %s: %s OD cells, %s transitions",
+                        fp.stem, f"{len(df):,}", f"{df['count'].sum():,}")
+        return [out.stem.split("=", 1)[1] for out, _ in todo]
+
+    # ───────────── reading ─────────────
+
+    def load(self, days=None, time_bins=None) -> pd.DataFrame:
+        """(day, time_bin, FROM, TO, count) rows of the selected days and time bins."""
+        days = self.days() if days is None else [str(d) for d in days]
+        filters = [("time_bin", "in", [int(b) for b in time_bins])] if time_bins is not None else None
+        frames = []
+        for day in days:
+            df = pq.read_table(self.day_path(day), filters=filters).to_pandas()
+            df.insert(0, "day", np.int32(day))
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame({"day": np.empty(0, np.int32), "time_bin": np.empty(0, np.int16),
+                                 "FROM": np.empty(0, np.int32), "TO": np.empty(0, np.int32),
+                                 "count": np.empty(0, np.int64)})
+        return pd.concat(frames, ignore_index=True)
+
+    def _period(self, df: pd.DataFrame, by: str) -> pd.Series:
+        date = pd.to_datetime(df["day"].astype(str), format="%Y%m%d")
+        if by == "day":
+            return df["day"]
+        if by == "week":
+            iso = date.dt.isocalendar()
+            return (iso["year"] * 100 + iso["week"]).astype(np.int32)      # e.g. 202313
+        if by == "weekday":
+            return date.dt.weekday.astype(np.int8)                            # Monday = 0
+        if by == "weekend":
+            return date.dt.weekday >= 5
+        if by == "hour":
+            return (df["time_bin"].astype(np.int32) * self.bin_minutes // 60).astype(np.int16)
+        raise ValueError(f"Unknown rollup {by!r}; choose one of {ROLLUPS}")
+
+    def rollup(self, by: str | None = None, days=None, time_bins=None) -> pd.DataFrame:
+        """
+        Counts summed to (<by>, FROM, TO), or to (FROM, TO) when ``by`` is None,
+        sorted by those keys.
+        """
+        df = self.load(days, time_bins)
+        keys = ["FROM", "TO"]
+        if by is not None:
+            df[by] = self._period(df, by)
+            keys = [by, *keys]
+        return df.groupby(keys, sort=True, as_index=False)["count"].sum()
+
+    def matrix(self, days=None, time_bins=None, zones=None) -> tuple[sparse.csr_matrix, np.ndarray]:
+        """(FROM × TO CSR counts summed over the selection, sorted zone ids of its axes)."""
+        df = self.rollup(None, days, time_bins)
+        tensor = TransitionTensor.from_arrays(np.zeros(len(df), np.int16), df["FROM"].to_numpy(),
+                                              df["TO"].to_numpy(), df["count"].to_numpy(),
+                                              zones=zones)
+        return tensor.total(), tensor.zones
+
+    def top_k(self, k: int = 10, origins=None, by: str | None = None,
+              days=None, time_bins=None) -> pd.DataFrame:
+        """
+        The ``k`` largest destinations per origin (per ``by`` period if given),
+        ranked 1..k; count ties go to the smaller zone id.
+        """
+        df = self.rollup(by, days, time_bins)
+        if origins is not None:
+            df = df[df["FROM"].isin(np.asarray(origins))]
+        group = [by, "FROM"] if by is not None else ["FROM"]
+        df = df.sort_values([*group, "count", "TO"], ascending=[True] * len(group) + [False, True],
+                            kind="stable", ignore_index=True)
+        keys = df[group].to_numpy()
+        start = np.ones(len(df), dtype=bool)
+        start[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+        idx = np.arange(len(df))
+        rank = idx - np.maximum.accumulate(np.where(start, idx, 0)) + 1
+        df["rank"] = rank
+        return df[rank <= k].reset_index(drop=True)
+
+    def export(self, path: Path, by: str | None = None, days=None, time_bins=None) -> pd.DataFrame:
+        """Write a rollup as sparse (…, FROM, TO, count) parquet."""
+        df = self.rollup(by, days, time_bins)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(path, index=False)
+        return df
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Append per-day transitions to the OD cube")
+    parser.add_argument("--src", type=Path, default=TRANSITIONS_DIR)
+    parser.add_argument("--cube", type=Path, default=CUBE_DIR)
+    parser.add_argument("--force", action="store_true", help="rewrite every day")
+    args = parser.parse_args()
+    ODCube(args.cube).append(sorted(args.src.glob("*.parquet")), force=args.force)
@@ -0,0 +1,118 @@
+# coding: utf-8
+"""
+Process-pool execution for the per-day drivers.
+
+`map_parallel` runs one task per day file on a pool of worker processes and
+reports the speedup over the serial path (sum of task times / wall time).
+`map_shards` splits one day by a stable hash of deviceid, so every device's
+pings land in exactly one shard and per-device deltas stay correct, runs the
+shards in parallel and hands the per-shard results back for merging.
+
+The worker count is capped by the memory each worker needs; when even two
+workers do not fit, or the pool dies (e.g. a worker is OOM-killed), the
+remaining tasks run serially in this process.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Default worker count: the SLURM allocation if there is one, else all cores
+N_WORKERS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+
+
+def available_memory_gb() -> float:
+    """Memory this job may use: the SLURM limit if set, else MemAvailable."""
+    if "SLURM_MEM_PER_NODE" in os.environ:
+        return int(os.environ["SLURM_MEM_PER_NODE"]) / 1024
+    if "SLURM_MEM_PER_CPU" in os.environ:
+        cpus = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+        return int(os.environ["SLURM_MEM_PER_CPU"]) * cpus / 1024
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+
+
+def plan_workers(requested: int, mem_per_worker_gb: float | None = None) -> int:
+    """Clamp ``requested`` workers to what fits in memory (at least 1)."""
+    workers = max(1, int(requested))
+    if mem_per_worker_gb:
+        fit = int(available_memory_gb() // mem_per_worker_gb)
+        if fit < workers:
+            logger.warning("Only %d worker(s) fit in %.1f GB at %.1f GB each (requested %d)",
+                           max(fit, 1), available_memory_gb(), mem_per_worker_gb, workers)
+            workers = max(fit, 1)
+    return workers
+
+
+def device_shards(ids, n_shards: int) -> np.ndarray:
+    """Stable shard number per row: same deviceid → same shard, on every run."""
+    return (pd.util.hash_array(np.asarray(ids)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def split_by_device(df: pd.DataFrame, n_shards: int, col: str = "deviceid") -> list[pd.DataFrame]:
+    shard = device_shards(df[col].to_numpy(), n_shards)
+    order = np.argsort(shard, kind="stable")
+    bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+    return [df.take(order[bounds[i]:bounds[i + 1]]) for i in range(n_shards)]
+
+
+def _timed(fn, item):
+    t0 = time.perf_counter()
+    result = fn(item)
+    return result, time.perf_counter() - t0
+
+
+def map_parallel(fn, items, workers: int = N_WORKERS,
+                 mem_per_worker_gb: float | None = None, label: str = "tasks") -> list:
+    """
+    Apply ``fn`` to every item on a process pool and return results in order.
+
+    ``fn`` must be picklable (module-level); notebooks rely on the fork start
+    method, which is the default on Linux.
+    """
+    items = list(items)
+    workers = min(plan_workers(workers, mem_per_worker_gb), max(len(items), 1))
+    results = [None] * len(items)
+    busy = 0.0
+    t0 = time.perf_counter()
+
+    pending = list(range(len(items)))
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {i: pool.submit(_timed, fn, items[i]) for i in pending}
+                for i, fut in futures.items():
+                    results[i], dt = fut.result()
+                    busy += dt
+                    pending.remove(i)
+        except BrokenProcessPool:
+            logger.warning("Worker pool died (out of memory?); running %d remaining %s serially",
+                           len(pending), label)
+    for i in pending:
+        results[i], dt = _timed(fn, items[i])
+        busy += dt
+
+    wall = time.perf_counter() - t0
+    logger.info("%d %s on %d worker(s) in %.1fs (serial ≈ %.1fs, speedup ×%.2f)",
+                len(items), label, workers, wall, busy, busy / wall if wall else 1.0)
+    return results
+
+
+def map_shards(fn, df: pd.DataFrame, n_shards: int, workers: int = N_WORKERS,
+               mem_per_worker_gb: float | None = None, col: str = "deviceid") -> list:
+    """Run ``fn`` on device-hash shards of ``df``; returns the per-shard results."""
+    shards = split_by_device(df, n_shards, col)
+    return map_parallel(fn, shards, workers, mem_per_worker_gb, label="shards")
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Partitioned columnar store for ping data.
+
+    store/devices.parquet                          deviceid string → int32 code
+    store/<stage>/day=<YYYYMMDD>/bucket=<BBB>.parquet
+
+Every stage (raw, denoised, binned) encodes deviceid through the same
+append-only dictionary, so a device keeps one int32 code across days and
+stages.  Within a day, rows are split into device-hash buckets
+(parallel.device_shards) and sorted by (deviceid, datetime); lat/lon are
+float32.  Because each bucket file is sorted by device, the per-row-group
+min/max statistics on deviceid cover narrow id ranges, so a read for a few
+devices opens only their buckets and skips every other row group.
+
+Usage:
+    python ping_store.py raw                     # ingest data/*.parquet
+    python ping_store.py denoised --src data_denoised
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parallel import N_WORKERS, device_shards, map_parallel
+
+STORE_DIR      = Path("store")
+DEVICES_FILE   = STORE_DIR / "devices.parquet"
+N_BUCKETS      = 32
+ROW_GROUP_ROWS = 131_072            # small enough for tight deviceid min/max per group
+COMPRESSION    = "zstd"
+MEM_PER_DAY_GB = 16                 # peak per worker while ingesting
+
+SOURCES = {"raw": Path("data"), "denoised": Path("data_denoised"), "binned": Path("data_binned")}
+SKIP    = {"slovenia_towers.parquet"}
+
+logger = logging.getLogger(__name__)
+
+
+# ───────────── device dictionary ─────────────
+
+class DeviceDictionary:
+    """Append-only deviceid → int32 code mapping; a code never changes once assigned."""
+
+    def __init__(self, ids=(), path: Path | None = None):
+        self.ids = pd.Index(np.asarray(ids, dtype=object))     # position = code
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path: Path = DEVICES_FILE) -> "DeviceDictionary":
+        path = Path(path)
+        if not path.exists():
+            return cls(path=path)
+        return cls(pd.read_parquet(path)["deviceid"].to_numpy(), path)
+
+    def save(self, path: Path | None = None) -> None:
+        path = Path(path or self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        pd.DataFrame({"deviceid": self.ids.to_numpy()}).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def add(self, ids) -> int:
+        """Assign codes to unseen ids (in order of first appearance); returns how many."""
+        uniques = pd.unique(np.asarray(ids, dtype=object))
+        new = uniques[self.ids.get_indexer(uniques) < 0]
+        if len(new):
+            self.ids = self.ids.append(pd.Index(new))
+        return len(new)
+
+    def encode(self, ids) -> np.ndarray:
+        """int32 code per id; every id must already be in the dictionary."""
+        codes, uniques = pd.factorize(np.asarray(ids, dtype=object))
+        lookup = self.ids.get_indexer(uniques)
+        if (lookup < 0).any():
+            raise KeyError(f"{(lookup < 0).sum():,} device ids are not in the dictionary; "
+                           f"add() them first")
+        out = lookup[codes].astype(np.int32)
+        out[codes < 0] = -1                                     # missing deviceid
+        return out
+
+    def decode(self, codes) -> np.ndarray:
+        return self.ids.to_numpy()[np.asarray(codes)]
+
+
+# ───────────── store ─────────────
+
+class PingStore:
+    def __init__(self, stage: str, root: Path = STORE_DIR, n_buckets: int = N_BUCKETS):
+        self.stage = stage
+        self.dir = Path(root) / stage
+        meta = self.dir / "_store.json"
+        if meta.exists():
+            with open(meta) as fh:
+                n_buckets = json.load(fh)["n_buckets"]          # fixed once written
+        self.n_buckets = n_buckets
+
+    def _write_meta(self) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / "_store.json", "w") as fh:
+            json.dump({"n_buckets": self.n_buckets}, fh)
+
+    def day_dir(self, day: str) -> Path:
+        return self.dir / f"day={day}"
+
+    def bucket_path(self, day: str, bucket: int) -> Path:
+        return self.day_dir(day) / f"bucket={bucket:03d}.parquet"
+
+    def days(self) -> list[str]:
+        return sorted(p.name.split("=", 1)[1] for p in self.dir.glob("day=*") if p.is_dir())
+
+    def buckets_of(self, codes) -> np.ndarray:
+        return device_shards(np.asarray(codes, dtype=np.int32), self.n_buckets)
+
+    # ───────────── writing ─────────────
+
+    def write_day(self, day: str, df: pd.DataFrame) -> None:
+        """
+        Replace ``day`` with ``df``, which needs int32-codable deviceid and a
+        datetime column.  Rows are bucketed, sorted by (deviceid, datetime) and
+        written with row groups of ROW_GROUP_ROWS.
+        """
+        df = df.assign(deviceid=df["deviceid"].to_numpy(np.int32))
+        for col in ("lat", "lon"):
+            if col in df.columns:
+                df[col] = df[col].astype(np.float32)
+        bucket = self.buckets_of(df["deviceid"].to_numpy())
+        order = np.lexsort((df["datetime"].to_numpy(), df["deviceid"].to_numpy(), bucket))
+        df = df.take(order).reset_index(drop=True)
+        bounds = np.searchsorted(bucket[order], np.arange(self.n_buckets + 1))
+
+        self._write_meta()
+        tmp = self.dir / f".day={day}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sorting = [pq.SortingColumn(table.schema.get_field_index("deviceid")),
+                   pq.SortingColumn(table.schema.get_field_index("datetime"))]
+        for b in range(self.n_buckets):
+            part = table.slice(bounds[b], bounds[b + 1] - bounds[b])
+            pq.write_table(part, tmp / f"bucket={b:03d}.parquet", row_group_size=ROW_GROUP_ROWS,
+                           compression=COMPRESSION, sorting_columns=sorting)
+        shutil.rmtree(self.day_dir(day), ignore_errors=True)
+        os.replace(tmp, self.day_dir(day))
+
+    # ───────────── reading ─────────────
+
+    def read(self, day: str, devices=None, columns=None) -> pd.DataFrame:
+        """
+        One day, or only the rows of ``devices`` (int32 codes).  With devices
+        given, only their buckets are opened and row groups whose deviceid
+        range misses them are skipped.
+        """
+        if devices is None:
+            paths = [self.bucket_path(day, b) for b in range(self.n_buckets)]
+            filters = None
+        else:
+            codes = np.unique(np.asarray(devices, dtype=np.int32))
+            paths = [self.bucket_path(day, b) for b in np.unique(self.buckets_of(codes))]
+            filters = [("deviceid", "in", codes.tolist())]
+        tables = [pq.read_table(p, columns=columns, filters=filters) for p in paths]
+        return pa.concat_tables(tables).to_pandas()
+
+
+# ───────────── ingest ─────────────
+
+def _raw_frame(df: pd.DataFrame, devices: DeviceDictionary) -> pd.DataFrame:
+    stamp = pd.to_datetime(df["date"].astype(str) + " " + df["time"].astype(str), dayfirst=True)
+    return pd.DataFrame({
+        "deviceid": devices.encode(df["deviceid"].to_numpy()),
+        "datetime": stamp.to_numpy(),
+        "lat": df["lat"].to_numpy(np.float32),
+        "lon": df["lon"].to_numpy(np.float32),
+    })
+
+
+def ingest_day(fp: Path, store: PingStore, devices: DeviceDictionary | None) -> int:
+    df = pd.read_parquet(fp)
+    if devices is not None:
+        df = _raw_frame(df, devices)
+    else:
+        # date/time strings are redundant next to datetime
+        df = df.drop(columns=[c for c in ("date", "time") if c in df.columns])
+    store.write_day(fp.stem, df)
+    logger.info("Stored %s: %s rows", fp.stem, f"{len(df):,}")
+    return len(df)
+
+
+def ingest(stage: str, files, root: Path = STORE_DIR, n_buckets: int = N_BUCKETS,
+           workers: int = N_WORKERS) -> None:
+    """
+    Copy per-day parquets into the store.  Raw days are dictionary-encoded
+    here (the dictionary grows serially before the days are written in
+    parallel); denoised and binned days already carry the codes Sequential
+    assigned from the same dictionary.
+    """
+    files = [f for f in files if f.name not in SKIP]
+    store = PingStore(stage, root, n_buckets)
+    devices = None
+    if stage == "raw":
+        devices = DeviceDictionary.load(Path(root) / DEVICES_FILE.name)
+        for fp in files:
+            added = devices.add(pd.read_parquet(fp, columns=["deviceid"])["deviceid"].to_numpy())
+            logger.info("%s: %s new devices", fp.name, f"{added:,}")
+        devices.save()
+    map_parallel(partial(ingest_day, store=store, devices=devices), files, workers,
+                 MEM_PER_DAY_GB, label="days")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Ingest per-day parquets into the ping store")
+    parser.add_argument("stage", choices=sorted(SOURCES))
+    parser.add_argument("--src", type=Path, help="input directory (default: the stage's own)")
+    parser.add_argument("--buckets", type=int, default=N_BUCKETS)
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    args = parser.parse_args()
+
+    src = args.src or SOURCES[args.stage]
+    ingest(args.stage, sorted(src.glob("*.parquet")), n_buckets=args.buckets,
+           workers=args.workers)
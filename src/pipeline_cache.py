@@ -0,0 +1,177 @@
+# coding: utf-8
+"""
+Content-addressed cache for the per-day pipeline stages.
+
+Every output file gets a manifest entry, ``<out_dir>/.manifest/<name>.json``,
+recording the stage name, its parameters, the sha256 of each input file and
+the sha256 of the output itself.  A stage redoes a day only when the output
+is missing or was modified, an input's content changed, or a parameter
+changed.  Inputs are compared by content, so when an upstream stage reruns
+and writes a byte-identical file, the downstream day is still up to date.
+
+Digests are reused while a file's (size, mtime) is unchanged, taken from the
+consuming stage's own entry or from the entry the producing stage wrote, so
+unchanged multi-GB parquets are not re-read on every run.
+
+`require_fresh` lets a stage refuse an input whose producing stage has not
+been rerun since that stage's own inputs changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST = ".manifest"
+
+_memo: dict = {}     # (path, size, mtime_ns) → sha256, inherited by forked workers
+
+
+class StaleOutputError(RuntimeError):
+    pass
+
+
+def _stat(path: Path) -> dict:
+    st = Path(path).stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def file_digest(path: Path, hint: dict | None = None) -> str:
+    """sha256 of a file; ``hint`` is a previous record with the same size/mtime."""
+    st = _stat(path)
+    memo_key = (str(path), st["size"], st["mtime_ns"])
+    if memo_key in _memo:
+        return _memo[memo_key]
+    if hint and hint.get("size") == st["size"] and hint.get("mtime_ns") == st["mtime_ns"]:
+        digest = hint["sha256"]
+    else:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 22), b""):
+                h.update(block)
+        digest = h.hexdigest()
+    _memo[memo_key] = digest
+    return digest
+
+
+def _file_record(path: Path, hint: dict | None = None) -> dict:
+    return {**_stat(path), "sha256": file_digest(path, hint)}
+
+
+def _entry_path(output: Path) -> Path:
+    output = Path(output)
+    return output.parent / MANIFEST / f"{output.name}.json"
+
+
+def read_entry(output: Path) -> dict | None:
+    try:
+        with open(_entry_path(output)) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _param_value(value):
+    """JSON-able parameter; files and arrays are represented by their content hash."""
+    if isinstance(value, Path):
+        return {"file": value.name, "sha256": file_digest(value)}
+    if isinstance(value, np.ndarray):
+        return {"array": hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _rel(path: Path, output: Path) -> str:
+    """Input path as recorded: relative to the output's directory, so runs from any cwd agree."""
+    return os.path.relpath(path, Path(output).parent)
+
+
+def _producer_hint(path: Path) -> dict | None:
+    upstream = read_entry(path)
+    return upstream["output"] if upstream else None
+
+
+class StageCache:
+    def __init__(self, stage: str, params: dict, force: bool = False):
+        self.stage = stage
+        # normalized once in the parent, e.g. grid/tower files are hashed here
+        self.params = json.loads(json.dumps({k: _param_value(v) for k, v in params.items()}))
+        self.force = force
+
+    def up_to_date(self, output: Path, inputs) -> bool:
+        output = Path(output)
+        if self.force or not output.exists():
+            return False
+        entry = read_entry(output)
+        if not entry or entry["stage"] != self.stage or entry["params"] != self.params:
+            return False
+        if set(entry["inputs"]) != {_rel(p, output) for p in inputs}:
+            return False
+        if file_digest(output, entry["output"]) != entry["output"]["sha256"]:
+            return False
+        for p in map(Path, inputs):
+            rec = entry["inputs"][_rel(p, output)]
+            if not p.exists() or file_digest(p, rec) != rec["sha256"]:
+                return False
+        return True
+
+    def pending(self, tasks, label: str = "outputs") -> list:
+        """
+        The (output, inputs) tasks that are not up to date.  Raises
+        StaleOutputError if any input is a stale output of an earlier stage.
+        """
+        tasks = list(tasks)
+        for _, inputs in tasks:
+            for p in inputs:
+                require_fresh(p)
+        todo = [(out, inputs) for out, inputs in tasks if not self.up_to_date(out, inputs)]
+        logging.info("%s: %d of %d %s up to date, %d to build",
+                     self.stage, len(tasks) - len(todo), len(tasks), label, len(todo))
+        return todo
+
+    def record(self, output: Path, inputs) -> None:
+        """Write the manifest entry for a freshly built output."""
+        output = Path(output)
+        entry = {
+            "stage": self.stage,
+            "params": self.params,
+            "inputs": {_rel(p, output): _file_record(Path(p), _producer_hint(Path(p)))
+                       for p in inputs},
+            "output": _file_record(output),
+        }
+        path = _entry_path(output)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as fh:
+            json.dump(entry, fh, indent=1)
+        os.replace(tmp, path)
+
+
+def require_fresh(path: Path) -> None:
+    """
+    Raise StaleOutputError if ``path`` was modified after its stage wrote it,
+    or if one of that stage's inputs changed since.  Files without a manifest
+    entry are accepted: with a warning in a directory some stage writes to
+    (an output from before the cache existed), quietly for source files such
+    as the raw days or the grid, which no stage produces.
+    """
+    path = Path(path)
+    entry = read_entry(path)
+    if entry is None:
+        if (path.parent / MANIFEST).is_dir():
+            logging.warning("%s has no manifest entry; cannot check it is up to date", path)
+        else:
+            logging.debug("%s is a source file (no manifest entry)", path)
+        return
+    if file_digest(path, entry["output"]) != entry["output"]["sha256"]:
+        raise StaleOutputError(f"{path} was modified after stage '{entry['stage']}' wrote it; "
+                               f"rerun that stage")
+    for rel, rec in entry["inputs"].items():
+        p = path.parent / rel
+        if not p.exists() or file_digest(p, rec) != rec["sha256"]:
+            raise StaleOutputError(f"{path} is stale: input {p} changed since stage "
+                                   f"'{entry['stage']}' ran; rerun that stage")
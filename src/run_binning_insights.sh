@@ -1,11 +1,14 @@
 #!/bin/bash
 #SBATCH --job-name=binning_insights
-#SBATCH --cpus-per-task=1       
+#SBATCH --cpus-per-task=1        # days run in parallel on this many cores
 #SBATCH --mem=64G                
 #SBATCH --time=02:00:00
 
+# Extra arguments are passed through, e.g.
+#   sbatch --mem=8G run_binning_insights.sh --stream   # bounded-memory mode
+#   sbatch run_binning_insights.sh --merge-days         # pool saved day states
 module load Anaconda3 
-python binning_insights.py
+python binning_insights.py "$@"
 
 echo "===== JOB END ($EXIT) ===== at $(date)"
 exit $EXIT
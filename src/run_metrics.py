@@ -0,0 +1,172 @@
+# coding: utf-8
+"""
+Per-stage run metrics for the pipeline scripts.
+
+Every stage of every file becomes one JSON line in
+``<METRICS_DIR>/<pipeline>.jsonl``:
+
+    {"run_id", "pipeline", "stage", "file", "start", "wall_s", "cpu_s",
+     "peak_rss_mb", "rows_in", "rows_out", "devices_in", "devices_out", "pid"}
+
+Lines are appended by whichever process ran the stage, so workers of
+map_parallel can record their own days.  `write_prometheus` turns the
+records of one run into ``<pipeline>.prom`` in the Prometheus text format
+for a node-exporter textfile collector, and `load` reads the JSON lines back
+to compare runs.
+
+Peak RSS is the kernel high-water mark (VmHWM), reset at the start of every
+lap.  Open laps fold the mark in before any reset, so a day-level stage
+still sees the peaks of the steps inside it.  Without /proc, ru_maxrss is
+used, which is the peak since process start.
+"""
+
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+METRICS_DIR = Path("metrics")
+RUN_ID = os.environ.setdefault("PIPELINE_RUN_ID", datetime.now().strftime("%Y%m%dT%H%M%S"))
+
+_open_laps: list = []
+
+
+def rss_mb(field: str = "VmRSS") -> float:
+    """Current (VmRSS) or peak (VmHWM) resident memory of this process, in MB."""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # peak since start
+
+
+def reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:          # Linux: VmHWM := VmRSS
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def _checkpoint() -> None:
+    """Fold the high-water mark into every open lap, then reset it."""
+    peak = rss_mb("VmHWM")
+    for lap in _open_laps:
+        lap.peak = max(lap.peak, peak)
+    reset_peak_rss()
+
+
+class Lap:
+    """Wall time, CPU time and peak RSS between successive `split` calls."""
+
+    def __init__(self):
+        _checkpoint()
+        self.peak = rss_mb()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        _open_laps.append(self)
+
+    def split(self) -> dict:
+        _checkpoint()
+        wall, cpu = time.perf_counter(), time.process_time()
+        usage = {"wall_s": wall - self.wall, "cpu_s": cpu - self.cpu, "peak_rss_mb": self.peak}
+        self.wall, self.cpu, self.peak = wall, cpu, rss_mb()
+        return usage
+
+    def close(self) -> None:
+        if self in _open_laps:
+            _open_laps.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def combine(usages) -> dict:
+    """Usage of parallel pieces (e.g. shards): longest wall, summed CPU, largest peak."""
+    usages = list(usages)
+    return {"wall_s": max(u["wall_s"] for u in usages),
+            "cpu_s": sum(u["cpu_s"] for u in usages),
+            "peak_rss_mb": max(u["peak_rss_mb"] for u in usages)}
+
+
+def emit(pipeline: str, stage: str, file=None, usage: dict | None = None, **counts) -> dict:
+    """Append one stage record (usage from `Lap.split`, counts like rows_in=…)."""
+    record = {"run_id": RUN_ID, "pipeline": pipeline, "stage": stage,
+              "file": None if file is None else Path(file).name,
+              "start": datetime.now().isoformat(timespec="seconds"),
+              **(usage or {}), **counts, "pid": os.getpid()}
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(METRICS_DIR / f"{pipeline}.jsonl", "a") as fh:
+        fh.write(json.dumps(record, default=int) + "\n")
+    return record
+
+
+@contextmanager
+def stage(pipeline: str, name: str, file=None, **counts):
+    """
+    Time the body as one stage.  Counts known up front go in as keywords; the
+    rest are set on the yielded dict (e.g. ``m["rows_out"] = len(df)``).
+    """
+    with Lap() as lap:
+        yield counts
+        emit(pipeline, name, file, lap.split(), **counts)
+
+
+def emit_steps(pipeline: str, file, steps, rows_in: int, devices_in: int) -> None:
+    """Records for consecutive (stage, rows, devices, usage) steps; each step's input is the previous output."""
+    for name, rows, devices, usage in steps:
+        emit(pipeline, name, file, usage, rows_in=rows_in, rows_out=rows,
+             devices_in=devices_in, devices_out=devices)
+        rows_in, devices_in = rows, devices
+
+
+def load(pipeline: str, run_id: str | None = None) -> pd.DataFrame:
+    """All records of ``pipeline`` (one run if ``run_id`` is given)."""
+    path = METRICS_DIR / f"{pipeline}.jsonl"
+    if not path.exists():
+        return pd.DataFrame()
+    df = pd.read_json(path, lines=True, dtype={"run_id": str})
+    return df if run_id is None else df[df["run_id"] == run_id].reset_index(drop=True)
+
+
+_PROM_METRICS = {
+    "wall_s":      ("pipeline_stage_wall_seconds", "Wall-clock time of the stage"),
+    "cpu_s":       ("pipeline_stage_cpu_seconds", "CPU time of the stage's process"),
+    "peak_rss_mb": ("pipeline_stage_peak_rss_megabytes", "Peak resident memory during the stage"),
+    "rows_in":     ("pipeline_stage_rows_in", "Rows entering the stage"),
+    "rows_out":    ("pipeline_stage_rows_out", "Rows leaving the stage"),
+    "devices_in":  ("pipeline_stage_devices_in", "Devices entering the stage"),
+    "devices_out": ("pipeline_stage_devices_out", "Devices leaving the stage"),
+}
+
+
+def write_prometheus(pipeline: str, run_id: str = RUN_ID) -> Path | None:
+    """Write ``<pipeline>.prom`` with one gauge sample per stage, file and metric of the run."""
+    df = load(pipeline, run_id)
+    if df.empty:
+        return None
+    lines = []
+    for col, (metric, help_text) in _PROM_METRICS.items():
+        if col not in df:
+            continue
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for rec in df[df[col].notna()].itertuples(index=False):
+            labels = (f'pipeline="{pipeline}",stage="{rec.stage}",'
+                      f'file="{rec.file or ""}",run_id="{run_id}"')
+            lines.append(f"{metric}{{{labels}}} {getattr(rec, col):g}")
+    out = METRICS_DIR / f"{pipeline}.prom"
+    tmp = out.with_suffix(".prom.tmp")
+    tmp.write_text("\n".join(lines) + "\n")
+    os.replace(tmp, out)                 # collectors never see a half-written file
+    return out
@@ -0,0 +1,187 @@
+# coding: utf-8
+"""
+Sort-based segment reductions over flat NumPy arrays.
+
+A *segment* is a run of rows that share one integer group code once the rows
+are ordered by that code.  Every helper below costs a constant number of
+vectorized passes, no matter how many groups there are, so per-group
+statistics never fall back to a Python call per group.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def factorize_keys(*keys) -> tuple[np.ndarray, int]:
+    """
+    Jointly factorize one or more key arrays.
+
+    Codes are assigned in order of first appearance, which is the same group
+    order that ``DataFrame.groupby(keys, sort=False)`` produces.
+
+    Returns:
+        (codes, n_groups) with ``codes`` as int64 in ``[0, n_groups)``.
+    """
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    n_groups = 1
+    for key in keys:
+        key_codes, uniques = pd.factorize(np.asarray(key), sort=False)
+        codes = codes * len(uniques) + key_codes
+        codes, uniques = pd.factorize(codes, sort=False)
+        n_groups = len(uniques)
+    return codes.astype(np.int64, copy=False), n_groups
+
+
+def first_index(codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Row index of the first occurrence of every group code."""
+    first = np.full(n_groups, -1, dtype=np.int64)
+    uniq, idx = np.unique(codes, return_index=True)
+    first[uniq] = idx
+    return first
+
+
+def segment_layout(sorted_codes: np.ndarray, n_groups: int) -> tuple[np.ndarray, np.ndarray]:
+    """(starts, counts) of every group inside an array sorted by group code."""
+    counts = np.bincount(sorted_codes, minlength=n_groups)
+    starts = np.zeros(n_groups, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return starts, counts
+
+
+def segment_sort(codes: np.ndarray, values: np.ndarray | None = None) -> np.ndarray:
+    """Permutation ordering rows by group code, then by ``values`` if given."""
+    if values is None:
+        return np.argsort(codes, kind="stable")
+    return np.lexsort((values, codes))
+
+
+def segment_mean(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    counts = np.bincount(codes, minlength=n_groups)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def segment_var(codes: np.ndarray, values: np.ndarray, n_groups: int,
+                mean: np.ndarray | None = None, ddof: int = 1) -> np.ndarray:
+    """Two-pass sample variance per group (NaN where count <= ddof)."""
+    if mean is None:
+        mean = segment_mean(codes, values, n_groups)
+    counts = np.bincount(codes, minlength=n_groups)
+    dev = values - mean[codes]
+    m2 = np.bincount(codes, weights=dev * dev, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > ddof, m2 / (counts - ddof), np.nan)
+
+
+def segment_extremes(sorted_values: np.ndarray, starts: np.ndarray,
+                     counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(min, max) per segment of a within-segment sorted array; empty → NaN."""
+    lo = np.full(len(starts), np.nan)
+    hi = np.full(len(starts), np.nan)
+    ok = counts > 0
+    lo[ok] = sorted_values[starts[ok]]
+    hi[ok] = sorted_values[starts[ok] + counts[ok] - 1]
+    return lo, hi
+
+
+def segment_kahan_sum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Kahan-compensated float64 sum of every non-empty segment, accumulated in
+    row order the way ``groupby().sum()`` does, so results match pandas bit
+    for bit (plain reductions can differ in the last ulp, enough to flip an
+    idxmax between equal totals).  One vectorized step per position in the
+    longest segment.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.diff(np.append(starts, len(values)))
+    by_len = np.argsort(-lengths, kind="stable")         # active segments form a prefix
+    seg_starts, seg_lens = starts[by_len], lengths[by_len]
+    total = np.zeros(len(starts))
+    comp = np.zeros(len(starts))
+    for k in range(int(seg_lens[0]) if len(seg_lens) else 0):
+        m = np.searchsorted(-seg_lens, -k, side="left")  # segments longer than k
+        y = values[seg_starts[:m] + k] - comp[:m]
+        t = total[:m] + y
+        comp[:m] = t - total[:m] - y
+        comp[:m][np.isnan(comp[:m])] = 0.0
+        total[:m] = t
+    out = np.empty(len(starts))
+    out[by_len] = total
+    return out
+
+
+def segment_argmax(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Index of the first maximum of every segment, for non-empty segments that
+    start at ``starts`` (ascending) and run to the next start.  Like idxmax,
+    ties go to the earliest row.
+    """
+    seg_max = np.maximum.reduceat(values, starts)
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    hit = np.flatnonzero(values == seg_max[seg])
+    first = np.ones(len(hit), dtype=bool)
+    first[1:] = seg[hit[1:]] != seg[hit[:-1]]
+    return hit[first]
+
+
+def segment_quantile(sorted_values: np.ndarray, starts: np.ndarray,
+                     counts: np.ndarray, q: float) -> np.ndarray:
+    """
+    Exact quantile per segment with linear interpolation (pandas' default).
+    ``sorted_values`` must be sorted within each segment; empty segments → NaN.
+    """
+    out = np.full(len(starts), np.nan)
+    ok = counts > 0
+    pos = q * (counts[ok] - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, counts[ok] - 1)
+    frac = pos - lo
+    a = sorted_values[starts[ok] + lo]
+    b = sorted_values[starts[ok] + hi]
+    out[ok] = a + (b - a) * frac
+    return out
+
+
+def segment_entropy(codes: np.ndarray, weights: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Shannon entropy (bits) of the distribution given by positive ``weights``
+    inside each group, e.g. per-device ping counts of one zone×hour bin.
+    """
+    total = np.bincount(codes, weights=weights, minlength=n_groups)
+    p = weights / total[codes]
+    return -np.bincount(codes, weights=p * np.log2(p), minlength=n_groups)
+
+
+def segment_rolling_median(codes: np.ndarray, values: np.ndarray, before: int, after: int,
+                           chunk: int = 1 << 20) -> np.ndarray:
+    """
+    Rolling median over rows ``i - before … i + after`` that share row i's
+    segment.  Segments must be contiguous runs of ``codes`` (e.g. rows sorted
+    by device).  NaNs are skipped and a window without values gives NaN, so
+    ``before, after = w // 2, w - 1 - w // 2`` reproduces pandas'
+    ``rolling(w, center=True, min_periods=1).median()`` per segment.
+
+    Works on (chunk × window) blocks: every row's window is gathered,
+    sorted with NaN/out-of-segment slots last, and the middle picked.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    offsets = np.arange(-before, after + 1)
+    out = np.empty(n)
+    for s in range(0, n, chunk):
+        rows = np.arange(s, min(s + chunk, n))
+        pos = rows[:, None] + offsets
+        idx = np.clip(pos, 0, n - 1)
+        win = values[idx]
+        outside = (pos < 0) | (pos >= n) | (codes[idx] != codes[rows, None])
+        win[outside] = np.nan
+        win.sort(axis=1)
+        cnt = np.count_nonzero(~np.isnan(win), axis=1)
+        lo = np.maximum(cnt - 1, 0) // 2
+        hi = cnt // 2
+        r = np.arange(len(rows))
+        med = (win[r, lo] + win[r, hi]) / 2
+        med[cnt == 0] = np.nan
+        out[rows] = med
+    return out
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Stay-point detection (Zheng et al.) for every device of a day at once.
+
+A stay point starts at an anchor ping i.  Scanning forward, the first ping j
+farther than DIST_THRESHOLD_M from the anchor closes it, and if more than
+TIME_THRESHOLD_S passed between i and j, the pings i..j-1 are a stay:
+
+    arrival = t_i, departure = t_j, centroid = mean(lat, lon of i..j-1)
+
+Either way the scan restarts at j.  This is the loop of stay_points.ipynb,
+including its tail rule: a device that never leaves its last anchor yields no
+stay for it.
+
+The scan pointer of every device advances one ping per step, so all devices
+run together on the (device, time)-sorted arrays.  As in hmm_smoothing,
+devices are ordered longest first, so the active ones form a prefix, and the
+Python loop runs max(pings per device) times with one vectorized distance
+test per step.  Centroids come from prefix sums.
+
+Output per day (data_stay_points/<day>.parquet), one row per stay:
+
+    deviceid, arrival, departure, lat, lon, n_pings, duration_min,
+    zone_id (zone of the centroid), time_bin (of the arrival)
+
+zone_id / time_bin match the binned data, so `zone_hour_stays` aggregates
+join the zone×hour features on (zone_id, time_bin).
+
+Usage:
+    python stay_points.py                    # every day in data_binned/
+    python stay_points.py --dist-m 200 --time-min 20 --force
+"""
+
+import argparse
+import logging
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from parallel import N_WORKERS, map_parallel
+from pipeline_cache import StageCache
+from zone_index import ZoneIndex
+
+# ───────────────────────── Config ─────────────────────────
+BINS_DIR         = Path("data_binned")
+OUT_DIR          = Path("data_stay_points")
+GRID_FILE        = Path("maps/minimalist_coning.geojson")
+DIST_THRESHOLD_M = 200.0
+TIME_THRESHOLD_S = 20 * 60
+TIME_BIN_MINUTES = 60                      # as in Binning_sequential
+MEM_PER_DAY_GB   = 8
+R                = 6_371_000.0             # Earth radius (m)
+
+logger = logging.getLogger(__name__)
+
+
+# ───────────────────────── Detection ─────────────────────────
+def detect(starts: np.ndarray, lat: np.ndarray, lon: np.ndarray, t: np.ndarray,
+           dist_m: float = DIST_THRESHOLD_M, time_s: float = TIME_THRESHOLD_S):
+    """
+    Stay points of every device in arrays sorted by (device, time).
+
+    Args:
+        starts: first row of every device (ascending).
+        lat, lon: degrees.  t: seconds (any integer or float clock).
+
+    Returns:
+        (first, leave) row indices: the stay covers rows first..leave-1 and is
+        closed by the ping at ``leave``.  Sorted by ``first``.
+    """
+    n = len(t)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    lengths = np.diff(np.append(starts, n))
+    by_len = np.argsort(-lengths, kind="stable")          # active devices form a prefix
+    seg_starts, seg_lens = starts[by_len], lengths[by_len]
+
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat_r)
+    # haversine d > dist_m  ⇔  sin²(dlat/2) + cos·cos·sin²(dlon/2) > sin²(dist_m / 2R)
+    limit = np.sin(dist_m / (2 * R)) ** 2
+
+    anchor = seg_starts.astype(np.int64)
+    firsts, leaves = [], []
+    for step in range(1, int(seg_lens[0])):
+        m = np.searchsorted(-seg_lens, -step, side="left")  # devices longer than step
+        a = anchor[:m]                                       # view: updated in place
+        j = seg_starts[:m] + step
+        h = (np.sin((lat_r[j] - lat_r[a]) / 2) ** 2
+             + cos_lat[a] * cos_lat[j] * np.sin((lon_r[j] - lon_r[a]) / 2) ** 2)
+        left = h > limit
+        stay = left & (t[j] - t[a] > time_s)
+        firsts.append(a[stay])
+        leaves.append(j[stay])
+        a[left] = j[left]
+
+    first = np.concatenate(firsts) if firsts else np.empty(0, dtype=np.int64)
+    leave = np.concatenate(leaves) if leaves else np.empty(0, dtype=np.int64)
+    order = np.argsort(first, kind="stable")
+    return first[order], leave[order]
+
+
+def stay_points(df: pd.DataFrame, dist_m: float = DIST_THRESHOLD_M,
+                time_s: float = TIME_THRESHOLD_S) -> pd.DataFrame:
+    """Stay-point table of ``df`` (deviceid, datetime, lat, lon; any row order)."""
+    dev_codes, _ = pd.factorize(df["deviceid"].to_numpy(), sort=True)
+    t_ns = df["datetime"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+    order = np.lexsort((t_ns, dev_codes))
+    dev = dev_codes[order]
+    t_ns = t_ns[order]
+    lat = df["lat"].to_numpy(dtype=np.float64)[order]
+    lon = df["lon"].to_numpy(dtype=np.float64)[order]
+
+    new_dev = np.ones(len(dev), dtype=bool)
+    new_dev[1:] = dev[1:] != dev[:-1]
+    first, leave = detect(np.flatnonzero(new_dev), lat, lon, t_ns / 1e9, dist_m, time_s)
+
+    lat_cs = np.concatenate([[0.0], np.cumsum(lat)])
+    lon_cs = np.concatenate([[0.0], np.cumsum(lon)])
+    n_pings = leave - first
+    return pd.DataFrame({
+        "deviceid": df["deviceid"].to_numpy()[order[first]],
+        "arrival": pd.to_datetime(t_ns[first]),
+        "departure": pd.to_datetime(t_ns[leave]),
+        "lat": (lat_cs[leave] - lat_cs[first]) / n_pings,
+        "lon": (lon_cs[leave] - lon_cs[first]) / n_pings,
+        "n_pings": n_pings.astype(np.int32),
+        "duration_min": (t_ns[leave] - t_ns[first]) / 60e9,
+    })
+
+
+def add_zone_keys(stays: pd.DataFrame, zone_index: ZoneIndex,
+                  minutes: int = TIME_BIN_MINUTES) -> pd.DataFrame:
+    """zone_id of the centroid (-1 outside every zone) and time_bin of the arrival."""
+    stays["zone_id"] = zone_index.lookup(stays["lat"].to_numpy(), stays["lon"].to_numpy())
+    mins = stays["arrival"].dt.hour * 60 + stays["arrival"].dt.minute
+    stays["time_bin"] = (mins // minutes).astype("int16")
+    return stays
+
+
+def zone_hour_stays(stays: pd.DataFrame) -> pd.DataFrame:
+    """Per (zone_id, time_bin): stay count, distinct devices and mean stay length."""
+    stays = stays[stays["zone_id"] != -1]
+    return (stays.groupby(["zone_id", "time_bin"])
+                 .agg(n_stays=("deviceid", "size"),
+                      stay_devices=("deviceid", "nunique"),
+                      stay_min_mean=("duration_min", "mean"))
+                 .reset_index())
+
+
+# ───────────────────────── Driver ─────────────────────────
+def process_day(fp: Path, zone_index: ZoneIndex, cache: StageCache = None,
+                dist_m: float = DIST_THRESHOLD_M, time_s: float = TIME_THRESHOLD_S):
+    logger.info(f"▶ Stay points for {fp.name}")
+    df = pd.read_parquet(fp, columns=["deviceid", "datetime", "lat", "lon"])
+    stays = add_zone_keys(stay_points(df, dist_m, time_s), zone_index)
+    out_fp = OUT_DIR / fp.name
+    stays.to_parquet(out_fp, index=False)
+    if cache is not None:
+        cache.record(out_fp, [fp])
+    logger.info(f"✔ {len(stays):,} stays of {stays['deviceid'].nunique():,} devices → {out_fp}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Stay-point detection for every device")
+    parser.add_argument("--dist-m", type=float, default=DIST_THRESHOLD_M)
+    parser.add_argument("--time-min", type=float, default=TIME_THRESHOLD_S / 60)
+    parser.add_argument("--workers", type=int, default=N_WORKERS)
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every day, even those whose binned file is unchanged")
+    args = parser.parse_args()
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    time_s = args.time_min * 60
+    cache = StageCache("stay_points", {"dist_m": args.dist_m, "time_s": time_s,
+                                       "grid": GRID_FILE}, force=args.force)
+    days = sorted(BINS_DIR.glob("*.parquet"))
+    todo = [inputs[0] for _, inputs in cache.pending([(OUT_DIR / fp.name, [fp]) for fp in days],
+                                                     label="days")]
+    zone_index = ZoneIndex.load_or_build(GRID_FILE)
+    map_parallel(partial(process_day, zone_index=zone_index, cache=cache,
+                         dist_m=args.dist_m, time_s=time_s),
+                 todo, args.workers, MEM_PER_DAY_GB, label="days")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Synthetic cellular pings in the schema of data/*.parquet.
+
+Every device follows one transport mode (walk / bike / car) for the day: it
+alternates moving legs and stops, turning gradually, and pings at random
+intervals.  On top of the trajectories the generator injects the artifacts
+the denoising stages remove:
+
+    tower fallbacks     ping placed on a cell tower (celltower_denoise)
+    repeated coords     one of a few operator fallback coordinates shared by
+                        many devices (remove_repeated_coords)
+    jumps               single far-off outliers (Zheng / sliding window)
+
+Rows are written shuffled, like the operator files, with deviceid / date /
+time as strings.  `synthetic_towers` and `synthetic_grid` give a matching
+towers file and zone grid, so the whole pipeline can run without operator
+data.
+
+Usage:
+    python synthetic_pings.py --rows 1000000 --out data/20230331.parquet
+    python synthetic_pings.py --rows 1000000 --workdir bench_data   # + towers and grid
+"""
+
+import argparse
+import logging
+from datetime import date as Date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ───────────────────────── Config ─────────────────────────
+SLOVENIA_BBOX    = (45.42, 13.38, 46.88, 16.61)     # lat_min, lon_min, lat_max, lon_max
+DAY              = Date(2023, 3, 31)
+PINGS_PER_DEVICE = 60                               # mean pings per device and day
+SAMPLE_INTERVAL_S = 600                             # mean gap between a device's pings
+MODES = {                                           # speed mean, sd (m/s), share of devices
+    "walk": (1.4, 0.3, 0.4),
+    "bike": (4.5, 1.2, 0.2),
+    "car":  (14.0, 5.0, 0.4),
+}
+STOP_RATE        = 0.6                              # share of pings taken while stopped
+TURN_SD_DEG      = 25.0                             # heading change between pings
+TOWER_FALLBACK_RATE = 0.03
+REPEATED_COORD_RATE = 0.02
+N_REPEATED_COORDS   = 5
+JUMP_RATE        = 0.005
+JUMP_SD_DEG      = 0.3
+N_TOWERS         = 2_000
+CHUNK_DEVICES    = 200_000                          # devices generated per batch
+
+M_PER_DEG_LAT = 111_320.0
+
+logger = logging.getLogger(__name__)
+
+_CLOCK = np.array([f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in range(86_400)],
+                  dtype=object)
+
+
+def synthetic_towers(n: int = N_TOWERS, seed: int = 0) -> pd.DataFrame:
+    """Tower positions (LAT, LON) in the bounding box, like data/slovenia_towers.parquet."""
+    rng = np.random.default_rng(seed)
+    lat0, lon0, lat1, lon1 = SLOVENIA_BBOX
+    return pd.DataFrame({"LAT": rng.uniform(lat0, lat1, n), "LON": rng.uniform(lon0, lon1, n)})
+
+
+def synthetic_grid(n_lat: int = 20, n_lon: int = 30):
+    """Rectangular zone grid over the bounding box, zone_id in row-major order."""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    lat0, lon0, lat1, lon1 = SLOVENIA_BBOX
+    lats = np.linspace(lat0, lat1, n_lat + 1)
+    lons = np.linspace(lon0, lon1, n_lon + 1)
+    cells = [box(lons[j], lats[i], lons[j + 1], lats[i + 1])
+             for i in range(n_lat) for j in range(n_lon)]
+    return gpd.GeoDataFrame({"zone_id": np.arange(len(cells), dtype=np.int32)},
+                            geometry=cells, crs="EPSG:4326")
+
+
+def _reflect(x: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    width = hi - lo
+    y = np.mod(x - lo, 2 * width)
+    return lo + np.where(y > width, 2 * width - y, y)
+
+
+def _device_chunk(first_device: int, n_devices: int, rng: np.random.Generator,
+                  towers: pd.DataFrame, repeated: np.ndarray, day: Date) -> pd.DataFrame:
+    lat0, lon0, lat1, lon1 = SLOVENIA_BBOX
+    counts = np.maximum(rng.poisson(PINGS_PER_DEVICE, n_devices), 1)
+    n = int(counts.sum())
+    dev = np.repeat(np.arange(n_devices), counts)
+    starts = np.zeros(n_devices, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    first = np.zeros(n, dtype=bool)
+    first[starts] = True
+
+    # ping times: exponential gaps from a random start, wrapped into the day
+    gaps = rng.exponential(SAMPLE_INTERVAL_S, n)
+    gaps[first] = rng.uniform(0, 86_400, n_devices)
+    t = np.cumsum(gaps)
+    t -= np.repeat(t[starts] - gaps[starts], counts)
+    t = (t % 86_400).astype(np.int64)
+    t = np.sort(t + dev * 86_400) - dev * 86_400        # ordered within each device
+    dt = np.diff(t, prepend=0)
+    dt[first] = 0
+
+    # per-device mode and speed, stops, heading random walk
+    names = list(MODES)
+    share = np.array([MODES[m][2] for m in names])
+    mode = rng.choice(len(names), n_devices, p=share / share.sum())
+    mean = np.array([MODES[m][0] for m in names])[mode]
+    sd = np.array([MODES[m][1] for m in names])[mode]
+    speed = np.abs(rng.normal(mean[dev], sd[dev]))
+    speed[rng.random(n) < STOP_RATE] = 0.0
+    turn = np.radians(rng.normal(0, TURN_SD_DEG, n))
+    turn[first] = rng.uniform(0, 2 * np.pi, n_devices)
+    heading = np.cumsum(turn)
+    heading -= np.repeat(heading[starts] - turn[starts], counts)
+
+    # displacement in degrees, accumulated per device from a random origin
+    step = speed * dt
+    home_lat = rng.uniform(lat0, lat1, n_devices)
+    home_lon = rng.uniform(lon0, lon1, n_devices)
+    dlat = step * np.cos(heading) / M_PER_DEG_LAT
+    dlon = step * np.sin(heading) / (M_PER_DEG_LAT * np.cos(np.radians(home_lat[dev])))
+    lat = np.cumsum(dlat); lon = np.cumsum(dlon)
+    lat -= np.repeat(lat[starts] - dlat[starts], counts)
+    lon -= np.repeat(lon[starts] - dlon[starts], counts)
+    lat = _reflect(home_lat[dev] + lat, lat0, lat1)      # bounce off the box edges
+    lon = _reflect(home_lon[dev] + lon, lon0, lon1)
+
+    # artifacts
+    u = rng.random(n)
+    tower = u < TOWER_FALLBACK_RATE
+    pick = rng.integers(0, len(towers), tower.sum())
+    lat[tower] = towers["LAT"].to_numpy()[pick]
+    lon[tower] = towers["LON"].to_numpy()[pick]
+    rep = (u >= TOWER_FALLBACK_RATE) & (u < TOWER_FALLBACK_RATE + REPEATED_COORD_RATE)
+    pick = rng.integers(0, len(repeated), rep.sum())
+    lat[rep], lon[rep] = repeated[pick, 0], repeated[pick, 1]
+    jump = rng.random(n) < JUMP_RATE
+    lat[jump] += rng.normal(0, JUMP_SD_DEG, jump.sum())
+    lon[jump] += rng.normal(0, JUMP_SD_DEG, jump.sum())
+
+    ids = np.array([f"dev{i:08d}" for i in range(first_device, first_device + n_devices)],
+                   dtype=object)
+    order = rng.permutation(n)                           # operator files are unordered
+    return pd.DataFrame({
+        "deviceid": ids[dev[order]],
+        "date": np.full(n, day.strftime("%d.%m.%Y"), dtype=object),
+        "time": _CLOCK[t[order]],
+        "lat": lat[order],
+        "lon": lon[order],
+    })
+
+
+def generate(n_rows: int, seed: int = 0, day: Date = DAY, towers: pd.DataFrame | None = None):
+    """Yield DataFrame chunks totalling about ``n_rows`` pings."""
+    rng = np.random.default_rng(seed)
+    towers = synthetic_towers(seed=seed) if towers is None else towers
+    lat0, lon0, lat1, lon1 = SLOVENIA_BBOX
+    repeated = np.column_stack([rng.uniform(lat0, lat1, N_REPEATED_COORDS),
+                                rng.uniform(lon0, lon1, N_REPEATED_COORDS)])
+    n_devices = max(int(round(n_rows / PINGS_PER_DEVICE)), 1)
+    for first in range(0, n_devices, CHUNK_DEVICES):
+        yield _device_chunk(first, min(CHUNK_DEVICES, n_devices - first), rng, towers,
+                            repeated, day)
+
+
+def write_day(path: Path, n_rows: int, seed: int = 0, day: Date = DAY,
+              towers: pd.DataFrame | None = None) -> int:
+    """Write a synthetic day to ``path`` chunk by chunk; returns the row count."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    writer = None
+    try:
+        for chunk in generate(n_rows, seed, day, towers):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    logger.info("Wrote %s synthetic pings to %s", f"{rows:,}", path)
+    return rows
+
+
+def write_workdir(workdir: Path, n_rows: int, seed: int = 0, day: Date = DAY) -> Path:
+    """data/<day>.parquet, data/slovenia_towers.parquet and maps/minimalist_coning.geojson."""
+    workdir = Path(workdir)
+    towers = synthetic_towers(seed=seed)
+    (workdir / "data").mkdir(parents=True, exist_ok=True)
+    (workdir / "maps").mkdir(parents=True, exist_ok=True)
+    towers.to_parquet(workdir / "data" / "slovenia_towers.parquet", index=False)
+    grid = workdir / "maps" / "minimalist_coning.geojson"
+    if not grid.exists():
+        synthetic_grid().to_file(grid, driver="GeoJSON")
+    out = workdir / "data" / f"{day:%Y%m%d}.parquet"
+    write_day(out, n_rows, seed, day, towers)
+    return out
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Synthetic pings in the data/*.parquet schema")
+    parser.add_argument("--rows", type=float, default=1e6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--day", type=Date.fromisoformat, default=DAY)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--out", type=Path, help="write one day file")
+    group.add_argument("--workdir", type=Path,
+                       help="write data/<day>.parquet plus synthetic towers and zone grid")
+    args = parser.parse_args()
+    if args.out:
+        write_day(args.out, int(args.rows), args.seed, args.day)
+    else:
+        write_workdir(args.workdir, int(args.rows), args.seed, args.day)
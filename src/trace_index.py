@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Per-device row-range index over the per-day parquet files.
+
+For every deviceid in a file the index lists (row_group, start, length)
+ranges, so `get_trace` decodes only the row groups holding that device and
+slices the rows out of them, instead of reading the whole day and filtering.
+Denoised and binned days are sorted by device and written in small row
+groups, so a device is one or two contiguous ranges; raw days are not, so a
+raw range spans the device's rows within a row group and is filtered on
+deviceid after reading (the raw ping_store is the fast path for raw traces).
+
+The index of ``<dir>/<day>.parquet`` is kept in ``<dir>/.traceidx/<day>.parquet``
+and rebuilt when the indexed file changes.
+
+Usage:
+    python trace_index.py denoised binned        # prebuild the indexes
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pipeline_cache import file_digest
+from ping_store import DEVICES_FILE, SKIP, SOURCES, DeviceDictionary
+
+INDEX_DIR = ".traceidx"
+
+logger = logging.getLogger(__name__)
+
+_loaded: dict = {}     # (path, size, mtime_ns) → TraceIndex, also the device dictionary
+
+
+def _device_values(column: pa.ChunkedArray) -> np.ndarray:
+    """deviceid as int64 codes or object strings (also for dictionary/categorical columns)."""
+    values = column.to_pandas().to_numpy()
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64)
+    return values.astype(object)
+
+
+class TraceIndex:
+    def __init__(self, path: Path, devices: np.ndarray, offsets: np.ndarray,
+                 row_group: np.ndarray, start: np.ndarray, length: np.ndarray):
+        self.path = Path(path)
+        self.devices = devices          # sorted unique deviceids
+        self.offsets = offsets          # device i → ranges[offsets[i]:offsets[i+1]]
+        self.row_group = row_group
+        self.start = start
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    # ───────────── construction ─────────────
+
+    @classmethod
+    def build(cls, path: Path) -> "TraceIndex":
+        pf = pq.ParquetFile(path)
+        keys, groups, starts, lengths = [], [], [], []
+        for rg in range(pf.num_row_groups):
+            ids = _device_values(pf.read_row_group(rg, columns=["deviceid"]).column(0))
+            if not len(ids):
+                continue
+            # one range per device per row group, from its first to its last row
+            uniq, first = np.unique(ids, return_index=True)
+            _, last = np.unique(ids[::-1], return_index=True)
+            last = len(ids) - 1 - last
+            keys.append(uniq)
+            groups.append(np.full(len(uniq), rg, dtype=np.int32))
+            starts.append(first.astype(np.int64))
+            lengths.append((last - first + 1).astype(np.int64))
+        if not keys:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(path, empty, np.zeros(1, dtype=np.int64), empty.astype(np.int32),
+                       empty, empty)
+
+        keys = np.concatenate(keys)
+        groups, starts, lengths = map(np.concatenate, (groups, starts, lengths))
+        order = np.lexsort((starts, groups, keys))
+        keys, groups, starts, lengths = keys[order], groups[order], starts[order], lengths[order]
+        devices, first = np.unique(keys, return_index=True)
+        offsets = np.append(first, len(keys)).astype(np.int64)
+        return cls(path, devices, offsets, groups, starts, lengths)
+
+    def _sidecar(self) -> Path:
+        return self.path.parent / INDEX_DIR / self.path.name
+
+    def save(self, source: dict) -> None:
+        counts = np.diff(self.offsets)
+        table = pa.table({
+            "deviceid": np.repeat(self.devices, counts),
+            "row_group": self.row_group,
+            "start": self.start,
+            "length": self.length,
+        }).replace_schema_metadata({"source": json.dumps(source)})
+        sidecar = self._sidecar()
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, sidecar)
+
+    @classmethod
+    def load_or_build(cls, path: Path) -> "TraceIndex":
+        """The index of ``path``, from memory, its sidecar, or built (and saved) now."""
+        path = Path(path)
+        st = path.stat()
+        memo_key = (str(path), st.st_size, st.st_mtime_ns)
+        if memo_key in _loaded:
+            return _loaded[memo_key]
+
+        sidecar = path.parent / INDEX_DIR / path.name
+        index = None
+        if sidecar.exists():
+            table = pq.read_table(sidecar)
+            source = json.loads(table.schema.metadata[b"source"])
+            if file_digest(path, source) == source["sha256"]:
+                keys = _device_values(table.column("deviceid"))
+                first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else \
+                    np.empty(0, dtype=np.int64)
+                index = cls(path, keys[first], np.append(first, len(keys)).astype(np.int64),
+                            table.column("row_group").to_numpy(), table.column("start").to_numpy(),
+                            table.column("length").to_numpy())
+            else:
+                logger.info("Trace index %s is stale, rebuilding", sidecar)
+
+        if index is None:
+            index = cls.build(path)
+            index.save({"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                        "sha256": file_digest(path)})
+            logger.info("Indexed %d devices of %s", len(index), path)
+        _loaded[memo_key] = index
+        return index
+
+    # ───────────── lookup ─────────────
+
+    def ranges(self, device) -> list[tuple[int, int, int]]:
+        """[(row_group, start, length)] holding ``device``; empty if absent."""
+        i = np.searchsorted(self.devices, device)
+        if i == len(self.devices) or self.devices[i] != device:
+            return []
+        s, e = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.row_group[s:e].tolist(), self.start[s:e].tolist(),
+                        self.length[s:e].tolist()))
+
+    def read(self, device, columns=None) -> pd.DataFrame:
+        """Rows of ``device`` in file order; only its row groups are decoded."""
+        pf = pq.ParquetFile(self.path)
+        if columns is not None and "deviceid" not in columns:
+            columns = ["deviceid", *columns]
+        parts = []
+        for rg, start, length in self.ranges(device):
+            table = pf.read_row_group(rg, columns=columns).slice(start, length)
+            ids = _device_values(table.column("deviceid"))
+            parts.append(table.filter(pa.array(ids == device)))
+        if not parts:
+            return pf.schema_arrow.empty_table().select(columns or pf.schema_arrow.names).to_pandas()
+        return pa.concat_tables(parts).to_pandas()
+
+
+def _devices() -> DeviceDictionary:
+    memo_key = (str(DEVICES_FILE), DEVICES_FILE.stat().st_mtime_ns)
+    if memo_key not in _loaded:
+        _loaded[memo_key] = DeviceDictionary.load(DEVICES_FILE)
+    return _loaded[memo_key]
+
+
+def get_trace(device, day: str, stage: str = "denoised", columns=None,
+              dirs: dict = SOURCES) -> pd.DataFrame:
+    """
+    One device's pings of ``day`` at ``stage`` (raw, denoised or binned).
+    ``device`` is a deviceid string or its int32 code from the device
+    dictionary; raw files hold strings, the later stages hold codes.
+    """
+    if stage == "raw" and not isinstance(device, str):
+        device = _devices().decode([device])[0]
+    elif stage != "raw" and isinstance(device, str):
+        device = int(_devices().encode([device])[0])
+    path = Path(dirs[stage]) / f"{day}.parquet"
+    return TraceIndex.load_or_build(path).read(device, columns)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    parser = argparse.ArgumentParser(description="Build per-device trace indexes")
+    parser.add_argument("stages", nargs="+", choices=sorted(SOURCES))
+    args = parser.parse_args()
+    for stage in args.stages:
+        for fp in sorted(SOURCES[stage].glob("*.parquet")):
+            if fp.name not in SKIP:
+                TraceIndex.load_or_build(fp)
@@ -0,0 +1,169 @@
+# coding: utf-8
+"""
+Sparse zone-transition counts per time bin.
+
+All time bins share one zone axis (sorted zone_ids) and are stacked into a
+single CSR matrix of shape (n_bins · n_zones, n_zones): the block of rows
+``[b · n_zones, (b + 1) · n_zones)`` is the FROM × TO count matrix of the
+b-th time bin.  It is built with one COO → CSR conversion (duplicates summed)
+from FROM/TO arrays, and a time bin is a zero-copy row slice of it.
+
+Saved as plain .npy files (indptr, indices, data, zones, time_bins), so
+`TransitionTensor.load` can memory-map a day's counts instead of reading
+them.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _positions(values: np.ndarray, axis: np.ndarray, name: str) -> np.ndarray:
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    if not len(axis):
+        raise KeyError(f"{name} values missing from the tensor's {name} axis (it is empty)")
+    pos = np.minimum(np.searchsorted(axis, values), len(axis) - 1)
+    if (axis[pos] != values).any():
+        raise KeyError(f"{name} values missing from the tensor's {name} axis")
+    return pos
+
+
+class TransitionTensor:
+    def __init__(self, counts: sparse.csr_matrix, zones: np.ndarray, time_bins: np.ndarray):
+        self.counts = counts              # (n_bins * n_zones, n_zones)
+        self.zones = zones                # sorted zone_ids
+        self.time_bins = time_bins        # sorted time bins
+
+    @property
+    def n_zones(self) -> int:
+        return len(self.zones)
+
+    def nnz(self) -> int:
+        return self.counts.nnz
+
+    # ───────────── construction ─────────────
+
+    @classmethod
+    def from_arrays(cls, time_bin, from_zone, to_zone, counts=None,
+                    zones=None, time_bins=None) -> "TransitionTensor":
+        """Count (time_bin, FROM, TO) triples; ``counts`` weights them (default 1)."""
+        time_bin = np.asarray(time_bin)
+        from_zone = np.asarray(from_zone).astype(np.int64)
+        to_zone = np.asarray(to_zone).astype(np.int64)
+        if zones is None:
+            zones = np.union1d(from_zone, to_zone)
+        if time_bins is None:
+            time_bins = np.unique(time_bin)
+        zones = np.asarray(zones, dtype=np.int64)
+        time_bins = np.asarray(time_bins, dtype=np.int64)
+        n = len(zones)
+
+        rows = _positions(time_bin, time_bins, "time_bin") * n + _positions(from_zone, zones, "zone")
+        cols = _positions(to_zone, zones, "zone")
+        data = np.ones(len(rows), dtype=np.int64) if counts is None else np.asarray(counts, np.int64)
+        mat = sparse.coo_matrix((data, (rows, cols)), shape=(len(time_bins) * n, n)).tocsr()
+        mat.sum_duplicates()
+        return cls(mat, zones, time_bins)
+
+    @classmethod
+    def from_transitions(cls, df: pd.DataFrame, **kw) -> "TransitionTensor":
+        """From create_zone_transitions_sequential_approach1 output (rows with VALID)."""
+        valid = df["VALID"].to_numpy(bool)
+        return cls.from_arrays(df["time_bin"].to_numpy()[valid], df["FROM"].to_numpy()[valid],
+                               df["TO"].to_numpy()[valid], **kw)
+
+    @classmethod
+    def from_counts(cls, df: pd.DataFrame, **kw) -> "TransitionTensor":
+        """From a (time_bin, FROM, TO, count) table such as data_transitions/<day>.parquet."""
+        return cls.from_arrays(df["time_bin"].to_numpy(), df["FROM"].to_numpy(),
+                               df["TO"].to_numpy(), df["count"].to_numpy(), **kw)
+
+    # ───────────── queries ─────────────
+
+    def _bin_index(self, time_bin) -> int:
+        return int(_positions(np.asarray([time_bin]), self.time_bins, "time_bin")[0])
+
+    def matrix(self, time_bin=None) -> sparse.csr_matrix:
+        """FROM × TO counts of one time bin, or summed over all bins when None."""
+        n = self.n_zones
+        if time_bin is None:
+            return self.total()
+        b = self._bin_index(time_bin)
+        return self.counts[b * n:(b + 1) * n]
+
+    def total(self, time_bins=None) -> sparse.csr_matrix:
+        """Counts summed over ``time_bins`` (all by default)."""
+        bins = self.time_bins if time_bins is None else np.asarray(time_bins)
+        coo = self.counts.tocoo()
+        b, r = np.divmod(coo.row, self.n_zones)
+        keep = np.isin(self.time_bins[b], bins)
+        out = sparse.coo_matrix((coo.data[keep], (r[keep], coo.col[keep])),
+                                shape=(self.n_zones, self.n_zones)).tocsr()
+        out.sum_duplicates()
+        return out
+
+    def outgoing(self, zone, time_bin=None) -> np.ndarray:
+        """Dense counts from ``zone`` to every zone (row slice)."""
+        i = int(_positions(np.asarray([zone]), self.zones, "zone")[0])
+        return self.matrix(time_bin)[i].toarray().ravel()
+
+    def incoming(self, zone, time_bin=None) -> np.ndarray:
+        """Dense counts from every zone into ``zone`` (column slice)."""
+        j = int(_positions(np.asarray([zone]), self.zones, "zone")[0])
+        return self.matrix(time_bin).tocsc()[:, j].toarray().ravel()
+
+    def probabilities(self, time_bin=None) -> sparse.csr_matrix:
+        """Row-normalized transition probabilities; zones with no exits keep empty rows."""
+        mat = self.matrix(time_bin).astype(np.float64)
+        sums = np.asarray(mat.sum(axis=1)).ravel()
+        inv = np.divide(1.0, sums, out=np.zeros_like(sums), where=sums > 0)
+        return sparse.diags(inv) @ mat
+
+    def to_frame(self) -> pd.DataFrame:
+        """(time_bin, FROM, TO, count), sorted like a groupby over those keys."""
+        coo = self.counts.tocoo()
+        b, r = np.divmod(coo.row.astype(np.int64), self.n_zones)
+        order = np.lexsort((coo.col, r, b))
+        return pd.DataFrame({
+            "time_bin": self.time_bins[b[order]],
+            "FROM": self.zones[r[order]],
+            "TO": self.zones[coo.col[order]],
+            "count": coo.data[order],
+        })
+
+    def merge(self, *others: "TransitionTensor") -> "TransitionTensor":
+        """Sum of tensors (e.g. days) over the union of their zones and time bins."""
+        parts = (self, *others)
+        frames = [p.to_frame() for p in parts]
+        df = pd.concat(frames, ignore_index=True)
+        return TransitionTensor.from_counts(
+            df, zones=np.unique(np.concatenate([p.zones for p in parts])),
+            time_bins=np.unique(np.concatenate([p.time_bins for p in parts])))
+
+    # ───────────── persistence ─────────────
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, arr in (("indptr", self.counts.indptr), ("indices", self.counts.indices),
+                          ("data", self.counts.data), ("zones", self.zones),
+                          ("time_bins", self.time_bins)):
+            np.save(path / f"{name}.npy", arr)
+        with open(path / "meta.json", "w") as fh:
+            json.dump({"shape": list(self.counts.shape)}, fh)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "TransitionTensor":
+        path = Path(path)
+        mode = "r" if mmap else None
+        arr = {name: np.load(path / f"{name}.npy", mmap_mode=mode)
+               for name in ("indptr", "indices", "data", "zones", "time_bins")}
+        with open(path / "meta.json") as fh:
+            shape = tuple(json.load(fh)["shape"])
+        counts = sparse.csr_matrix((arr["data"], arr["indices"], arr["indptr"]), shape=shape,
+                                   copy=False)
+        return cls(counts, np.asarray(arr["zones"]), np.asarray(arr["time_bins"]))
@@ -1,55 +1,223 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+"""
+Zone×hour transport-mode inference.
 
+Default: K-Means on all_days_features.parquet, held in memory.
+
+--stream: MiniBatchKMeans fitted batch by batch over the per-day feature
+files (data_bin_features/<day>_features.parquet).  The fitted model and the
+digests of the days it has seen are persisted with joblib, so a run after a
+new day arrives only streams that day through ``partial_fit`` and labels it;
+earlier days keep their label files unless --relabel is given.  If a day
+already in the model changed, the model is fitted again from scratch.
+
+Usage:
+    python unsupervised_learning.py                 # in-memory, all days
+    python unsupervised_learning.py --stream        # incremental, per day
+    python unsupervised_learning.py --stream --relabel
+"""
+
+import argparse
+import logging
+
+import joblib
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 from pathlib import Path
-from sklearn.cluster import KMeans
-from hmmlearn import hmm
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from hmm_smoothing import hard_emissions, smooth, soft_emissions, sticky_transitions
+from pipeline_cache import file_digest
 
 # ───────────────────────── Config ─────────────────────────
-FEATURE_FILE = Path("data_bin_features") / "all_days_features.parquet"
+FEATS_DIR    = Path("data_bin_features")
+FEATURE_FILE = FEATS_DIR / "all_days_features.parquet"
 OUT_DIR      = FEATURE_FILE.parent / "mode_inference_simple"
-OUT_DIR.mkdir(exist_ok=True)
+MODEL_FILE   = OUT_DIR / "kmeans_stream.joblib"
+LABELS_DIR   = OUT_DIR / "labels"                # <day>_modes.parquet (--stream)
 MODE_NAMES   = ["Walk", "Bike", "Car", "Others"]
 N_CLUSTERS   = len(MODE_NAMES)
+BATCH_ROWS   = 65_536                            # feature rows per partial_fit / predict
+P_SELF       = 0.9                               # HMM probability of keeping the mode
+SOFT_TEMPERATURE = 1.0                           # softmax(-d² / T) over k-means distances
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s: %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
 
-# ───────────────────── Load & Filter ─────────────────────
-df = pd.read_parquet(FEATURE_FILE)
-# drop any bins with non‐positive speeds (if you like) or keep all:
-df = df[df.speed_mean >= 0.0].reset_index(drop=True)
 
 # ────────────────────── Build Feature Matrix ──────────────────────
-# we work in log‐space to tame heavy tails
-X = np.column_stack([
-    np.log1p(df["speed_mean"].values),
-    np.log1p(df["dwell_mean"].values),
-])
-
-# ───────────────────────── K-Means ─────────────────────────
-km = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
-labels_km = km.fit_predict(X)
-
-# map each cluster ID → a transport mode by sorting on centroid speed
-centers = km.cluster_centers_[:, 0]             # first dimension = log-speed
-order   = np.argsort(centers)                   # slowest→fastest
-cluster_to_mode = { int(order[i]): MODE_NAMES[i] for i in range(N_CLUSTERS) }
-df["mode_kmeans"] = [cluster_to_mode[c] for c in labels_km]
+def feature_matrix(df: pd.DataFrame) -> np.ndarray:
+    # we work in log‐space to tame heavy tails
+    return np.column_stack([
+        np.log1p(df["speed_mean"].values),
+        np.log1p(df["dwell_mean"].values),
+    ])
+
+
+def cluster_modes(centers: np.ndarray) -> np.ndarray:
+    """Mode index of every cluster ID, by sorting on centroid speed (slowest→fastest)."""
+    order = np.argsort(centers[:, 0])               # first dimension = log-speed
+    mode_of = np.empty(len(order), dtype=np.int64)
+    mode_of[order] = np.arange(len(order))
+    return mode_of
+
+
+def mode_labels(mode_idx: np.ndarray) -> pd.Categorical:
+    return pd.Categorical.from_codes(mode_idx, categories=MODE_NAMES)
+
 
 # ──────────────────── HMM Smoothing ────────────────────
-model = hmm.CategoricalHMM(n_components=N_CLUSTERS, init_params="")
-p_self = 0.9
-cross  = (1 - p_self) / (N_CLUSTERS - 1)
-tm     = np.full((N_CLUSTERS, N_CLUSTERS), cross)
-np.fill_diagonal(tm, p_self)
+def hmm_smooth(df: pd.DataFrame, labels: np.ndarray,
+               distances: np.ndarray | None = None) -> np.ndarray:
+    """
+    Viterbi path per zone across its time bins.  With k-means ``distances``
+    the emissions are soft; otherwise each cluster label is taken as observed
+    exactly (identity emissions).
+    """
+    if distances is not None:
+        log_emit = soft_emissions(distances, SOFT_TEMPERATURE)
+    else:
+        log_emit = hard_emissions(labels, np.eye(N_CLUSTERS))
+    return smooth(df["zone_id"].to_numpy(), df["time_bin"].to_numpy(), log_emit,
+                  sticky_transitions(N_CLUSTERS, P_SELF))
+
+
+# ───────────────────── In-memory mode ─────────────────────
+def infer_all_days(feature_file: Path = FEATURE_FILE, soft: bool = False) -> pd.DataFrame:
+    df = pd.read_parquet(feature_file)
+    # drop any bins with non‐positive speeds (if you like) or keep all:
+    df = df[df.speed_mean >= 0.0].reset_index(drop=True)
+
+    X  = feature_matrix(df)
+    km = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
+    labels_km = km.fit_predict(X)
+
+    mode_of = cluster_modes(km.cluster_centers_)
+    df["mode_kmeans"] = mode_labels(mode_of[labels_km])
+    df["mode_hmm"] = mode_labels(mode_of[hmm_smooth(df, labels_km,
+                                                    km.transform(X) if soft else None)])
+    return df
+
+
+# ───────────────────── Streaming mode ─────────────────────
+def _batches(fp: Path, batch_rows: int = BATCH_ROWS):
+    """(zone_id, time_bin, X) per record batch, bins with speed_mean < 0 dropped."""
+    cols = ["zone_id", "time_bin", "speed_mean", "dwell_mean"]
+    for batch in pq.ParquetFile(fp).iter_batches(batch_size=batch_rows, columns=cols):
+        df = batch.to_pandas()
+        df = df[df.speed_mean >= 0.0]
+        if len(df):
+            yield df[["zone_id", "time_bin"]], feature_matrix(df)
+
+
+def load_model(path: Path = MODEL_FILE) -> dict:
+    """
+    The persisted bundle: {"kmeans": MiniBatchKMeans | None,
+    "days": {stem: {"size", "mtime_ns", "sha256"}}}.
+    """
+    if path.exists():
+        return joblib.load(path)
+    return {"kmeans": None, "days": {}}
 
-model.startprob_    = np.full(N_CLUSTERS, 1.0 / N_CLUSTERS)
-model.transmat_     = tm
-model.emissionprob_ = np.eye(N_CLUSTERS)
 
-labels_hmm = model.predict(labels_km.reshape(-1,1))
-df["mode_hmm"] = [cluster_to_mode[c] for c in labels_hmm]
+def _day_record(fp: Path, prev) -> dict:
+    """size/mtime_ns/sha256 of a day file; an unchanged file is not rehashed."""
+    st = fp.stat()
+    hint = prev if isinstance(prev, dict) else None  # older bundles stored the bare sha256
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_digest(fp, hint)}
+
+
+def _digest(record) -> str | None:
+    return record["sha256"] if isinstance(record, dict) else record
+
+
+def fit_days(bundle: dict, day_files, batch_rows: int = BATCH_ROWS) -> list[Path]:
+    """
+    Stream every day not yet seen through partial_fit and return those days.
+
+    A fitted day cannot be taken back out of the model, so if any seen day's
+    file changed, the model is discarded and every day is fitted again.
+    A day is only recorded once its rows reached the model: the first fit
+    waits for N_CLUSTERS rows, which may take more than one day.
+    """
+    records = {fp.stem: _day_record(fp, bundle["days"].get(fp.stem)) for fp in day_files}
+    changed = [fp.name for fp in day_files if fp.stem in bundle["days"]
+               and _digest(bundle["days"][fp.stem]) != records[fp.stem]["sha256"]]
+    if changed:
+        logger.warning(f"Fitted days changed since the last run ({', '.join(changed)}); refitting")
+        bundle["kmeans"], bundle["days"] = None, {}
+    new = [fp for fp in day_files if fp.stem not in bundle["days"]]
+
+    km = bundle["kmeans"]
+    pending = None                                   # first fit needs ≥ N_CLUSTERS rows
+    waiting = []                                     # days whose rows are all in pending
+    for fp in new:
+        for _, X in _batches(fp, batch_rows):
+            if km is None:
+                pending = X if pending is None else np.vstack([pending, X])
+                if len(pending) < N_CLUSTERS:
+                    continue
+                km = MiniBatchKMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=3,
+                                     batch_size=batch_rows)
+                X, pending = pending, None
+            km.partial_fit(X)
+        waiting.append(fp)
+        if km is not None:
+            for done in waiting:
+                bundle["days"][done.stem] = records[done.stem]
+                logger.info(f"   • Fitted {done.name}")
+            waiting = []
+    # refresh size/mtime of the seen days, so the next run skips hashing them
+    bundle["days"].update({stem: records[stem] for stem in bundle["days"] if stem in records})
+    bundle["kmeans"] = km
+    return new
+
+
+def label_day(km: MiniBatchKMeans, fp: Path, batch_rows: int = BATCH_ROWS,
+              soft: bool = False) -> pd.DataFrame:
+    keys, dists = [], []
+    for key, X in _batches(fp, batch_rows):
+        keys.append(key)
+        dists.append(km.transform(X))
+    df = pd.concat(keys, ignore_index=True) if keys else pd.DataFrame(columns=["zone_id", "time_bin"])
+    distances = np.concatenate(dists) if dists else np.empty((0, N_CLUSTERS))
+    labels_km = distances.argmin(axis=1)             # = km.predict
+
+    mode_of = cluster_modes(km.cluster_centers_)
+    df["cluster"] = labels_km.astype(np.int8)
+    df["mode_kmeans"] = mode_labels(mode_of[labels_km])
+    df["mode_hmm"] = mode_labels(mode_of[hmm_smooth(df, labels_km, distances if soft else None)])
+    return df
+
+
+def infer_streaming(relabel: bool = False, refit: bool = False,
+                    batch_rows: int = BATCH_ROWS, soft: bool = False) -> pd.DataFrame:
+    days = sorted(fp for fp in FEATS_DIR.glob("*_features.parquet") if fp != FEATURE_FILE)
+    bundle = {"kmeans": None, "days": {}} if refit else load_model()
+    new = fit_days(bundle, days, batch_rows)
+    if bundle["kmeans"] is None:
+        raise FileNotFoundError(f"No feature rows under {FEATS_DIR}; run binning_insights.py first")
+    joblib.dump(bundle, MODEL_FILE)
+    logger.info(f"✔ Model covers {len(bundle['days'])} days ({len(new)} new) → {MODEL_FILE}")
+
+    LABELS_DIR.mkdir(parents=True, exist_ok=True)
+    label_path = lambda fp: LABELS_DIR / f"{fp.stem.removesuffix('_features')}_modes.parquet"
+    todo = days if relabel or refit else [fp for fp in days
+                                          if fp in new or not label_path(fp).exists()]
+    for fp in todo:
+        label_day(bundle["kmeans"], fp, batch_rows, soft).to_parquet(label_path(fp), index=False)
+        logger.info(f"   • Labelled {fp.name}")
+
+    return pd.concat([pd.read_parquet(label_path(fp), columns=["mode_kmeans", "mode_hmm"])
+                      for fp in days], ignore_index=True)
+
 
 # ─────────────────────── Plotting ───────────────────────
 def make_pretty_bar(counts, title, out_svg):
@@ -68,12 +236,34 @@ def make_pretty_bar(counts, title, out_svg):
     plt.close(fig)
     print(f"✔ Saved {out_svg}")
 
-# compute and plot
-for col, svg, title in [
-    ("mode_kmeans", OUT_DIR/"global_kmeans.svg", "Global K-Means Mode Distribution"),
-    ("mode_hmm",     OUT_DIR/"global_hmm.svg",     "Global HMM-Smoothed Mode Distribution")
-]:
-    pct = (df[col]
-           .value_counts(normalize=True)
-           .reindex(MODE_NAMES, fill_value=0) * 100)
-    make_pretty_bar(pct.values, title, svg)
+
+def plot_distributions(df: pd.DataFrame):
+    for col, svg, title in [
+        ("mode_kmeans", OUT_DIR/"global_kmeans.svg", "Global K-Means Mode Distribution"),
+        ("mode_hmm",     OUT_DIR/"global_hmm.svg",     "Global HMM-Smoothed Mode Distribution")
+    ]:
+        pct = (df[col]
+               .value_counts(normalize=True)
+               .reindex(MODE_NAMES, fill_value=0) * 100)
+        make_pretty_bar(pct.values, title, svg)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zone×hour transport-mode inference")
+    parser.add_argument("--stream", action="store_true",
+                        help="fit MiniBatchKMeans incrementally over the per-day feature files")
+    parser.add_argument("--relabel", action="store_true",
+                        help="with --stream: relabel every day with the current model")
+    parser.add_argument("--refit", action="store_true",
+                        help="with --stream: discard the saved model and fit from scratch")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--soft-emissions", action="store_true",
+                        help="HMM emissions from k-means distances instead of hard labels")
+    args = parser.parse_args()
+
+    OUT_DIR.mkdir(exist_ok=True)
+    if args.stream:
+        df = infer_streaming(args.relabel, args.refit, args.batch_rows, args.soft_emissions)
+    else:
+        df = infer_all_days(soft=args.soft_emissions)
+    plot_distributions(df)
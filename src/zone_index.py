@@ -0,0 +1,148 @@
+# coding: utf-8
+"""
+Raster lookup index for point → zone_id assignment.
+
+The zoning is rasterized once onto a fine lat/lon grid.  Each cell holds
+  • the zone_id of the single polygon whose interior fully contains it,
+  • NO_ZONE if no polygon touches it, or
+  • BOUNDARY if a zone boundary crosses or touches it (or zones overlap).
+Looking a ping up is plain array arithmetic on its lat/lon; only pings that
+fall into BOUNDARY cells get an exact point-in-polygon test, so results are
+identical to gpd.sjoin(..., predicate="within") followed by first match.
+
+The raster is cached next to the grid file and rebuilt when the grid file's
+contents or the cell size change.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+GRID_FILE = Path("maps/minimalist_coning.geojson")
+CELL_DEG  = 0.001                   # raster cell size in degrees (~110 m × 78 m)
+
+NO_ZONE  = -1
+BOUNDARY = -2
+
+
+def _digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_grid(grid_file: Path = GRID_FILE) -> gpd.GeoDataFrame:
+    """Zone polygons in WGS-84 with a zone_id column (row number if absent)."""
+    grid = gpd.read_file(grid_file)
+    if "zone_id" not in grid.columns:
+        grid["zone_id"] = np.arange(len(grid), dtype="int32")
+    return grid.to_crs("EPSG:4326")
+
+
+class ZoneIndex:
+    def __init__(self, raster: np.ndarray, x0: float, y0: float, cell: float,
+                 geoms: np.ndarray, zone_ids: np.ndarray):
+        self.raster = raster
+        self.x0, self.y0, self.cell = x0, y0, cell
+        self.geoms = geoms
+        self.zone_ids = zone_ids.astype(np.int32)
+        self._tree = shapely.STRtree(geoms)
+
+    # ───────────── construction ─────────────
+
+    @classmethod
+    def from_grid(cls, grid: gpd.GeoDataFrame, cell: float = CELL_DEG) -> "ZoneIndex":
+        geoms = grid.geometry.to_numpy()
+        zone_ids = grid["zone_id"].to_numpy()
+        minx, miny, maxx, maxy = grid.total_bounds
+        x0 = np.floor(minx / cell) * cell - cell
+        y0 = np.floor(miny / cell) * cell - cell
+        nx = int(np.ceil((maxx - x0) / cell)) + 1
+        ny = int(np.ceil((maxy - y0) / cell)) + 1
+        raster = np.full((ny, nx), NO_ZONE, dtype=np.int32)
+
+        for geom, zid in zip(geoms, zone_ids):
+            if geom is None or geom.is_empty:
+                continue
+            gx0, gy0, gx1, gy1 = geom.bounds
+            ix0, ix1 = int((gx0 - x0) // cell), int((gx1 - x0) // cell) + 1
+            iy0, iy1 = int((gy0 - y0) // cell), int((gy1 - y0) // cell) + 1
+            xs = x0 + np.arange(ix0, ix1) * cell
+            ys = y0 + np.arange(iy0, iy1) * cell
+            bx, by = np.meshgrid(xs, ys)
+            boxes = shapely.box(bx, by, bx + cell, by + cell)
+
+            shapely.prepare(geom)
+            inside = shapely.contains_properly(geom, boxes)
+            touch = shapely.intersects(geom, boxes) & ~inside
+
+            window = raster[iy0:iy1, ix0:ix1]
+            window[touch] = BOUNDARY
+            taken = inside & (window != NO_ZONE)       # overlapping zones
+            window[taken] = BOUNDARY
+            window[inside & ~taken] = zid
+
+        return cls(raster, float(x0), float(y0), float(cell), geoms, zone_ids)
+
+    @classmethod
+    def load_or_build(cls, grid_file: Path = GRID_FILE, cell: float = CELL_DEG,
+                      cache: Path | None = None) -> "ZoneIndex":
+        """Load the cached raster for ``grid_file`` or build and cache it."""
+        grid_file = Path(grid_file)
+        cache = Path(cache) if cache else grid_file.with_suffix(".zoneidx.npz")
+        digest = _digest(grid_file)
+        grid = load_grid(grid_file)
+
+        if cache.exists():
+            z = np.load(cache)
+            if str(z["digest"]) == digest and float(z["cell"]) == cell:
+                return cls(z["raster"], float(z["x0"]), float(z["y0"]), cell,
+                           grid.geometry.to_numpy(), grid["zone_id"].to_numpy())
+            logging.info("Zone index %s is stale, rebuilding", cache)
+
+        logging.info("Building zone index for %s (cell %.4f°)", grid_file, cell)
+        index = cls.from_grid(grid, cell)
+        np.savez(cache, raster=index.raster, x0=index.x0, y0=index.y0,
+                 cell=cell, digest=digest)
+        boundary = (index.raster == BOUNDARY).mean()
+        logging.info("Cached zone index to %s (%d×%d cells, %.1f%% boundary)",
+                     cache, *index.raster.shape, 100 * boundary)
+        return index
+
+    # ───────────── lookup ─────────────
+
+    def lookup(self, lat, lon) -> np.ndarray:
+        """zone_id for every (lat, lon) pair; NO_ZONE (-1) when outside all zones."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        ny, nx = self.raster.shape
+        with np.errstate(invalid="ignore"):
+            fx = np.floor((lon - self.x0) / self.cell)
+            fy = np.floor((lat - self.y0) / self.cell)
+            ok = (fx >= 0) & (fx < nx) & (fy >= 0) & (fy < ny)
+
+        zone = np.full(len(lat), NO_ZONE, dtype=np.int32)
+        zone[ok] = self.raster[fy[ok].astype(np.intp), fx[ok].astype(np.intp)]
+
+        edge = np.flatnonzero(zone == BOUNDARY)
+        if len(edge):
+            zone[edge] = self._exact(lat[edge], lon[edge])
+        return zone
+
+    def _exact(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Point-in-polygon test; the first matching zone wins, like sjoin + first()."""
+        pts = shapely.points(lon, lat)
+        pt_idx, geom_idx = self._tree.query(pts, predicate="within")
+        out = np.full(len(pts), NO_ZONE, dtype=np.int32)
+        order = np.lexsort((geom_idx, pt_idx))
+        pt_idx, geom_idx = pt_idx[order], geom_idx[order]
+        first = np.ones(len(pt_idx), dtype=bool)
+        first[1:] = pt_idx[1:] != pt_idx[:-1]
+        out[pt_idx[first]] = self.zone_ids[geom_idx[first]]
+        return out